@@ -8,7 +8,7 @@ ANSIBLE_METADATA = {
 
 import re
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
+from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec, viptela_wait_argument_spec
 
 
 def run_module():
@@ -22,6 +22,7 @@ def run_module():
                          wait = dict(type='bool', default=False),
                          aggregate=dict(type='list'),
     )
+    argument_spec.update(viptela_wait_argument_spec())
 
     # seed the result dict in the object
     # we primarily care about changed and state
@@ -64,6 +65,14 @@ def run_module():
 
     central_policy_dict = viptela.get_central_policy_dict(remove_key=False)
 
+    if viptela.params['state'] == 'present' and not module.check_mode:
+        # Fetch every definition type referenced by the new policies once (concurrently) and the lists once,
+        # so that names are converted to IDs from in-memory indexes below.
+        definition_types = [policy_item['type'] for policy in policy_list if policy['policyName'] not in central_policy_dict
+                            for policy_item in policy['policyDefinition']['assembly']]
+        policy_definition_ids = viptela.get_policy_definition_ids(definition_types)
+        policy_list_ids = viptela.get_policy_list_ids()
+
     compare_values = ['policyName', 'policyDescription', 'policyType', 'policyDefinition']
     ignore_values = ["lastUpdatedOn", "lastUpdatedBy", "templateId", "createdOn", "createdBy"]
 
@@ -99,9 +108,8 @@ def run_module():
                     regex = re.compile(r'^(?P<type>.*)Lists$')
                     for policy_item in policy['policyDefinition']['assembly']:
                         definition_name = policy_item.pop('definitionName')
-                        policy_definition_dict = viptela.get_policy_definition_dict(policy_item['type'])
-                        if definition_name in policy_definition_dict:
-                            policy_item['definitionId'] = policy_definition_dict[definition_name]['definitionId']
+                        if (policy_item['type'], definition_name) in policy_definition_ids:
+                            policy_item['definitionId'] = policy_definition_ids[(policy_item['type'], definition_name)]
                         else:
                             viptela.fail_json(msg="Cannot find policy definition {0}".format(definition_name))
                         for entry in policy_item['entries']:
@@ -110,9 +118,10 @@ def run_module():
                                 if match:
                                     type = match.groups('type')[0]
                                     if type in viptela.POLICY_LIST_TYPES:
-                                        policy_list_dict = viptela.get_policy_list_dict(type)
                                         for index, list_name in enumerate(list):
-                                            list[index] = policy_list_dict[list_name]['listId']
+                                            if (type, list_name) not in policy_list_ids:
+                                                viptela.fail_json(msg="Cannot find {0} list {1}".format(type, list_name))
+                                            list[index] = policy_list_ids[(type, list_name)]
                                     else:
                                         viptela.fail_json(msg="Cannot find list type {0}".format(type))
 
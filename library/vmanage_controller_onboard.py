@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+import os
+from ansible.module_utils.basic import AnsibleModule, json
+from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec, viptela_wait_argument_spec
+from collections import OrderedDict
+
+
+def find_controller(device_index, controller):
+    return (device_index['deviceIP'].get(controller['transport_ip'])
+            or device_index['host-name'].get(controller.get('name')) or {})
+
+
+def check_responses(viptela, stage, controllers, responses):
+    errors = ['{0}: {1}'.format(controller['transport_ip'], response.error)
+              for controller, response in zip(controllers, responses) if response.error]
+    if errors:
+        viptela.fail_json(msg='{0} of {1} controllers failed to {2}'.format(len(errors), len(controllers), stage),
+                          errors=errors)
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = viptela_argument_spec()
+    argument_spec.update(controllers=dict(type='list', elements='dict', required=True,
+                                          options=dict(name=dict(type='str'),
+                                                       transport_ip=dict(type='str'),
+                                                       device_ip=dict(type='str'),
+                                                       personality=dict(type='str', choices=['vmanage', 'vsmart', 'vbond']),
+                                                       device_username=dict(type='str', aliases=['device_user']),
+                                                       device_password=dict(type='str', no_log=True),
+                                                       cert=dict(type='str'),
+                                                       )),
+                         device_username=dict(type='str', aliases=['device_user']),
+                         device_password=dict(type='str', no_log=True),
+                         csr_dir=dict(type='path'),
+                         push=dict(type='bool', default=True),
+                         )
+    argument_spec.update(viptela_wait_argument_spec())
+
+    # seed the result dict in the object
+    # we primarily care about changed and state
+    # change is if this module effectively modified the target
+    # state will include any data that you want your module to pass back
+    # for consumption, for example, in a subsequent task
+    result = dict(
+        changed=False,
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(argument_spec=argument_spec,
+                           supports_check_mode=True,
+                           )
+    viptela = viptelaModule(module)
+
+    controllers = []
+    for controller in viptela.params['controllers']:
+        controller = dict(controller)
+        controller['transport_ip'] = controller.get('transport_ip') or controller.get('device_ip')
+        if not controller['transport_ip'] or not controller.get('personality'):
+            viptela.fail_json(msg="Each controller needs a transport_ip and a personality")
+        controller['device_username'] = controller.get('device_username') or viptela.params['device_username']
+        controller['device_password'] = controller.get('device_password') or viptela.params['device_password']
+        controllers.append(controller)
+
+    # Every stage runs across all controllers at once, at most `concurrency` requests at a time, and each
+    # stage works from one fetch of the controller inventory.
+    results = OrderedDict((controller['transport_ip'], {'name': controller.get('name'), 'what_changed': []})
+                          for controller in controllers)
+    device_index = viptela.get_device_index('controllers')
+
+    # Add the controllers that vManage does not know yet
+    new_controllers = [controller for controller in controllers if not find_controller(device_index, controller)]
+    for controller in new_controllers:
+        if not controller['device_username'] or not controller['device_password']:
+            viptela.fail_json(msg="device_username and device_password must be specified when add a new device")
+        results[controller['transport_ip']]['what_changed'].append('new')
+    if new_controllers and not module.check_mode:
+        responses = viptela.request_many([('/dataservice/system/device', 'POST', {
+            "deviceIP": controller['transport_ip'],
+            "username": controller['device_username'],
+            "password": controller['device_password'],
+            "personality": controller['personality'],
+            "generateCSR": "false"
+        }) for controller in new_controllers])
+        check_responses(viptela, 'add', new_controllers, responses)
+        viptela.device_index.pop('controllers', None)
+        device_index = viptela.get_device_index('controllers')
+
+    # Generate a CSR for every controller that has none yet
+    csr_controllers = []
+    for controller in controllers:
+        device = find_controller(device_index, controller)
+        if 'deviceCSR' in device:
+            results[controller['transport_ip']]['csr'] = device['deviceCSR']
+        else:
+            results[controller['transport_ip']]['what_changed'].append('csr')
+            csr_controllers.append(controller)
+    if csr_controllers and not module.check_mode:
+        responses = viptela.request_many([('/dataservice/certificate/generate/csr', 'POST', {
+            "deviceIP": find_controller(device_index, controller).get('deviceIP', controller['transport_ip'])
+        }) for controller in csr_controllers])
+        check_responses(viptela, 'generate a CSR', csr_controllers, responses)
+        for controller, response in zip(csr_controllers, responses):
+            try:
+                results[controller['transport_ip']]['csr'] = response.json['data'][0]['deviceCSR']
+            except (KeyError, IndexError, TypeError):
+                results[controller['transport_ip']]['csr'] = None
+
+    if viptela.params['csr_dir'] and not module.check_mode:
+        if not os.path.isdir(viptela.params['csr_dir']):
+            os.makedirs(viptela.params['csr_dir'])
+        for transport_ip, controller_result in results.items():
+            if controller_result.get('csr'):
+                controller_result['csr_file'] = os.path.join(viptela.params['csr_dir'], '{0}.csr'.format(transport_ip))
+                with open(controller_result['csr_file'], 'w') as f:
+                    f.write(controller_result['csr'])
+
+    # Install the signed certificates that were given and are not installed yet
+    cert_controllers = [controller for controller in controllers if controller.get('cert') and
+                        controller['cert'] != find_controller(device_index, controller).get('deviceEnterpriseCertificate')]
+    for controller in cert_controllers:
+        results[controller['transport_ip']]['what_changed'].append('deviceEnterpriseCertificate')
+    if cert_controllers and not module.check_mode:
+        responses = viptela.request_many([('/dataservice/certificate/install/signedCert', 'POST', controller['cert'])
+                                          for controller in cert_controllers])
+        check_responses(viptela, 'install the certificate', cert_controllers, responses)
+        action_ids = []
+        for controller, response in zip(cert_controllers, responses):
+            if not response.json or 'id' not in response.json:
+                viptela.fail_json(msg='Did not get action ID after installing certificate for {0}.'.format(controller['transport_ip']))
+            results[controller['transport_ip']]['action_id'] = response.json['id']
+            action_ids.append(response.json['id'])
+        viptela.waitfor_actions_completion(action_ids)
+
+        # One push sends all of the new certificates to the controllers
+        if viptela.params['push']:
+            viptela.result['push_action_id'] = viptela.push_certificates()
+
+    viptela.result['controllers'] = results
+    viptela.result['changed'] = any(controller_result['what_changed'] for controller_result in results.values())
+
+    viptela.exit_json(**viptela.result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
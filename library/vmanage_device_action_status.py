@@ -8,14 +8,17 @@ ANSIBLE_METADATA = {
 
 import time
 from ansible.module_utils.basic import AnsibleModule, json
-from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
+from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec, viptela_wait_argument_spec
 
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
     argument_spec = viptela_argument_spec()
-    argument_spec.update(id = dict(type='str', required=True),
+    argument_spec.update(id = dict(type='str'),
+                         ids = dict(type='list'),
+                         wait = dict(type='bool', default=False),
     )
+    argument_spec.update(viptela_wait_argument_spec())
 
     # seed the result dict in the object
     # we primarily care about changed and state
@@ -32,12 +35,28 @@ def run_module():
     # supports check mode
     module = AnsibleModule(argument_spec=argument_spec,
                            supports_check_mode=True,
+                           required_one_of=[['id', 'ids']],
                            )
     viptela = viptelaModule(module)
 
-    response = viptela.request('/dataservice/device/action/status/{0}'.format(viptela.params['id']))
-    if response.json:
+    if viptela.params['ids']:
+        # Join on many actions at once: their status is polled together in one loop
+        action_ids = list(viptela.params['ids'])
+        if viptela.params['id'] and viptela.params['id'] not in action_ids:
+            action_ids.insert(0, viptela.params['id'])
+        if viptela.params['wait']:
+            viptela.waitfor_actions_completion(action_ids)
+        else:
+            actions = viptela.poll_actions(action_ids, timeout=0)
+            viptela.result['actions'] = dict((action_id, viptela.get_action_summary(action))
+                                             for action_id, action in actions.items())
+    elif viptela.params['wait']:
+        response = viptela.waitfor_action_completion(viptela.params['id'])
         viptela.result['json'] = response.json
+    else:
+        response = viptela.request('/dataservice/device/action/status/{0}'.format(viptela.params['id']))
+        if response.json:
+            viptela.result['json'] = response.json
 
     viptela.exit_json(**viptela.result)
 
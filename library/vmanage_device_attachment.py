@@ -8,7 +8,194 @@ ANSIBLE_METADATA = {
 
 import time
 from ansible.module_utils.basic import AnsibleModule, json
-from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
+from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec, viptela_wait_argument_spec
+from collections import OrderedDict
+
+
+def build_device_template_variables(device_data, variables, template_variables, optional_template_variables):
+    device_template_variables = {
+            "csv-status": "complete",
+            "csv-deviceId": device_data['uuid'],
+            "csv-deviceIP": device_data['deviceIP'],
+            "csv-host-name": device_data['host-name'],
+            '//system/host-name': device_data['host-name'],
+            '//system/system-ip': device_data['system-ip'],
+            '//system/site-id': device_data['site-id'],
+        }
+
+    # For each of the variables passed in, match them up with the names of the variables requires in the
+    # templates and add them with the corresponding property.  The the variables is not in template_variables,
+    # just leave it out since it is not required.
+    for key, value in variables.items():
+        if key in template_variables:
+            property = template_variables[key]
+            device_template_variables[property] = value
+
+    # When dealing with optional parameters if we do not have explicitely set a value for it
+    # we must add the optional parameter to the payload with { key: 'TEMPLATE_IGNORE'}
+    for key, value in optional_template_variables.items():
+        property = template_variables[key]
+        if property not in device_template_variables:
+            device_template_variables[property] = 'TEMPLATE_IGNORE'
+
+    return device_template_variables
+
+
+def variables_changed(device_template_variables, current_variables):
+    # Convert both to a string and compare.  For some reason, there can be an int/str
+    # mismatch.  It might be indicative of a problem...
+    for property in device_template_variables:
+        if str(device_template_variables[property]) != str(current_variables.get(property)):
+            return True
+    return False
+
+
+def get_aggregate_device_data(viptela, device, device_index):
+    device_name = device.get('device_name') or device.get('device') or device.get('host-name')
+    system_ip = device.get('device_ip') or device.get('system_ip')
+    if device.get('uuid'):
+        device_data = dict(device_index.get(device['uuid'], {}))
+        if 'uuid' not in device_data:
+            viptela.fail_json(msg='Cannot find device with UUID: {0}.'.format(device['uuid']))
+    elif device_name:
+        device_data = dict(device_index.get(device_name, {}))
+        if 'uuid' not in device_data:
+            viptela.fail_json(msg='Cannot find device with name: {0}.'.format(device_name))
+    else:
+        viptela.fail_json(msg='Each device needs a uuid or device_name', device=device)
+
+    # If this is a preallocation, we need to set these things.
+    for key, value, name in [('system-ip', system_ip, 'system_ip'), ('deviceIP', system_ip, 'system_ip'),
+                             ('site-id', device.get('site_id'), 'site_id'), ('host-name', device_name, 'device_name')]:
+        if not device_data.get(key):
+            if value:
+                device_data[key] = value
+            elif viptela.params['state'] == 'present':
+                viptela.fail_json(msg='{0} is needed when pre-attaching templates'.format(name), device=device)
+
+    return device_data
+
+
+def run_aggregate(viptela, module):
+    """Attach (or detach) many devices with one schema and input fetch per template and chunked attach requests."""
+    # One fetch of each inventory resolves every device in the aggregate
+    device_index = {}
+    responses = viptela.request_many([('/dataservice/system/device/vedges', 'GET', None),
+                                      ('/dataservice/system/device/controllers', 'GET', None)], fail_on_error=True)
+    for response in responses:
+        for device_data in response.json.get('data', []):
+            device_index[device_data['uuid']] = device_data
+            if device_data.get('host-name'):
+                device_index[device_data['host-name']] = device_data
+
+    device_list = [(device, get_aggregate_device_data(viptela, device, device_index))
+                   for device in viptela.params['aggregate']]
+    action_ids = []
+
+    if viptela.params['state'] == 'present':
+        # Group the devices by template so that each template's schema and current input is fetched once
+        template_devices = OrderedDict()
+        for device, device_data in device_list:
+            template = device.get('template') or viptela.params['template']
+            if not template:
+                viptela.fail_json(msg='Must specify a template with state present', device=device)
+            template_devices.setdefault(template, []).append((device, device_data))
+
+        device_template_dict = viptela.get_device_template_dict(factory_default=True, fields=['templateId'])
+        for template in template_devices:
+            if template not in device_template_dict:
+                viptela.fail_json(msg='Template {0} not found.'.format(template))
+
+        template_list = list(template_devices)
+        template_ids = [device_template_dict[template]['templateId'] for template in template_list]
+        responses = viptela.request_many(
+            [('/dataservice/template/device/config/input', 'POST', viptela.template_input_payload(template_id))
+             for template_id in template_ids] +
+            [('/dataservice/template/device/config/attached/{0}'.format(template_id), 'GET', None)
+             for template_id in template_ids], fail_on_error=True)
+        template_schemas = [viptela.parse_template_schema(response.json) for response in responses[:len(template_ids)]]
+        template_attachments = [set(viptela.parse_template_attachments(response.json, key='uuid'))
+                                for response in responses[len(template_ids):]]
+
+        template_payloads = OrderedDict()
+        for template, template_id, template_schema in zip(template_list, template_ids, template_schemas):
+            payloads = OrderedDict()
+            for device, device_data in template_devices[template]:
+                variables = device.get('variables') or {}
+                missing = [variable for variable in template_schema['mandatory_variables'] if variable not in variables]
+                if missing:
+                    viptela.fail_json(msg='Template {0} requires variables for {1}: {2}'.format(
+                        template, device_data['host-name'], ', '.join(sorted(missing))))
+                payloads[device_data['uuid']] = build_device_template_variables(
+                    device_data, variables, template_schema['variables'], template_schema['optional_variables'])
+            template_payloads[template_id] = payloads
+
+        # Compare the input on last attach for all already attached devices of a template in one call
+        compare_templates = []
+        for template_id, attached_uuids in zip(template_ids, template_attachments):
+            attached = [uuid for uuid in template_payloads[template_id] if uuid in attached_uuids]
+            if attached:
+                compare_templates.append((template_id, attached))
+        responses = viptela.request_many(
+            [('/dataservice/template/device/config/input/', 'POST',
+              {"templateId": template_id, "deviceIds": attached, "isEdited": "true", "isMasterEdited": "false"})
+             for template_id, attached in compare_templates], fail_on_error=True)
+        current_input = {}
+        for (template_id, attached), response in zip(compare_templates, responses):
+            for current_variables in response.json.get('data', []):
+                current_input[(template_id, current_variables.get('csv-deviceId'))] = current_variables
+
+        changed_devices = OrderedDict()
+        for template_id, payloads in template_payloads.items():
+            for uuid, device_template_variables in payloads.items():
+                current_variables = current_input.get((template_id, uuid))
+                if current_variables is None or variables_changed(device_template_variables, current_variables):
+                    changed_devices.setdefault(template_id, []).append(device_template_variables)
+                    viptela.result['what_changed'].append(device_template_variables['csv-host-name'])
+
+        if changed_devices:
+            viptela.result['changed'] = True
+        if not module.check_mode:
+            batch_size = max(1, viptela.params['batch_size'])
+            for template_id, device_variables in changed_devices.items():
+                for index in range(0, len(device_variables), batch_size):
+                    payload = {
+                        "deviceTemplateList":
+                        [
+                            {
+                                "templateId": template_id,
+                                "device": device_variables[index:index + batch_size],
+                                "isEdited": False,
+                                "isMasterEdited": False
+                            }
+                        ]
+                    }
+                    response = viptela.request('/dataservice/template/device/config/attachfeature', method='POST', payload=payload)
+                    if response.json and 'id' in response.json:
+                        action_ids.append(response.json['id'])
+                    else:
+                        viptela.fail_json(msg='Did not get action ID after attaching device to template.')
+    else:
+        # Detach in one request per device type
+        detach_devices = OrderedDict()
+        for device, device_data in device_list:
+            if 'templateId' in device_data:
+                detach_devices.setdefault(device_data['deviceType'], []).append(
+                    {"deviceId": device_data['uuid'], "deviceIP": device_data['deviceIP']})
+                viptela.result['what_changed'].append(device_data['host-name'])
+        if detach_devices:
+            viptela.result['changed'] = True
+        if not module.check_mode:
+            for device_type, devices in detach_devices.items():
+                payload = {"deviceType": device_type, "devices": devices}
+                response = viptela.request('/dataservice/template/config/device/mode/cli', method='POST', payload=payload)
+                if response.json and 'id' in response.json:
+                    action_ids.append(response.json['id'])
+                else:
+                    viptela.fail_json(msg='Did not get action ID after detaching devices from template.')
+
+    viptela.result['action_ids'] = action_ids
+    return action_ids
 
 
 def run_module():
@@ -28,7 +215,10 @@ def run_module():
                          template = dict(type='str'),
                          variables=dict(type='dict', default={}),
                          wait=dict(type='bool', default=False),
+                         aggregate=dict(type='list', aliases=['devices']),
+                         batch_size=dict(type='int', default=200),
     )
+    argument_spec.update(viptela_wait_argument_spec())
 
     # seed the result dict in the object
     # we primarily care about changed and state
@@ -49,6 +239,14 @@ def run_module():
     viptela = viptelaModule(module)
     viptela.result['what_changed'] = []
 
+    if viptela.params['aggregate'] and viptela.params['state'] in ['present', 'absent']:
+        action_ids = run_aggregate(viptela, module)
+        # If told, wait for the status of the requests and report it
+        if viptela.params['wait'] and action_ids:
+            viptela.waitfor_actions_completion(action_ids)
+        viptela.logout()
+        viptela.exit_json(**viptela.result)
+
     if viptela.params['personality'] == 'vedge':
         device_type = 'vedges'
     else:
@@ -94,7 +292,7 @@ def run_module():
             viptela.fail_json(msg='site-id must be defined for {0}.'.format(viptela.params['device']))
 
         # Get template data and see if it is a real template
-        device_template_dict = viptela.get_device_template_dict(factory_default=True)
+        device_template_dict = viptela.get_device_template_dict(factory_default=True, fields=['templateId'])
         if viptela.params['template']:
             if viptela.params['template'] not in device_template_dict:
                 viptela.fail_json(msg='Template {0} not found.'.format(viptela.params['template']))
@@ -103,10 +301,11 @@ def run_module():
             viptela.fail_json(msg='Must specify a template with state present')
 
         # Make sure they passed in the required variables
-        # get_template_variables provides a variable name -> property mapping
-        template_variables = viptela.get_template_variables(device_template_dict[viptela.params['template']]['templateId'])
-        optional_template_variables = viptela.get_template_optional_variables(device_template_dict[viptela.params['template']]['templateId'])
-        mandatory_template_variables = {k: template_variables[k] for k in set(template_variables) - set(optional_template_variables)}
+        # get_template_schema provides variable name -> property mappings from a single input fetch
+        template_schema = viptela.get_template_schema(template_data['templateId'])
+        template_variables = template_schema['variables']
+        optional_template_variables = template_schema['optional_variables']
+        mandatory_template_variables = template_schema['mandatory_variables']
         if mandatory_template_variables:
             if viptela.params['variables']:
                 for variable in mandatory_template_variables:
@@ -116,30 +315,8 @@ def run_module():
         viptela.result['template_variables'] = template_variables
 
         # Construct the variable payload
-        device_template_variables = {
-                "csv-status": "complete",
-                "csv-deviceId": device_data['uuid'],
-                "csv-deviceIP": device_data['deviceIP'],
-                "csv-host-name": device_data['host-name'],
-                '//system/host-name': device_data['host-name'],
-                '//system/system-ip': device_data['system-ip'],
-                '//system/site-id': device_data['site-id'],
-            }
-
-        # For each of the variables passed in, match them up with the names of the variables requires in the
-        # templates and add them with the corresponding property.  The the variables is not in template_variables,
-        # just leave it out since it is not required.
-        for key, value in viptela.params['variables'].items():
-            if key in template_variables:
-                property = template_variables[key]
-                device_template_variables[property] = viptela.params['variables'][key]
-
-        # When dealing with optional parameters if we do not have explicitely set a value for it
-        # we must add the optional parameter to the payload with { key: 'TEMPLATE_IGNORE'}
-        for key, value in optional_template_variables.items():
-            property = template_variables[key]
-            if property not in device_template_variables:
-                device_template_variables[property] = 'TEMPLATE_IGNORE'
+        device_template_variables = build_device_template_variables(device_data, viptela.params['variables'],
+                                                                    template_variables, optional_template_variables)
 
         attached_uuid_list = viptela.get_template_attachments(template_data['templateId'], key='uuid')
 
@@ -159,11 +336,8 @@ def run_module():
                 current_variables = response.json['data'][0]
                 # viptela.result['old'] = current_variables
                 # viptela.result['new'] = device_template_variables
-                # Convert both to a string and compare.  For some reason, there can be an int/str
-                # mismatch.  It might be indicative of a problem...
-                for property in device_template_variables:
-                    if str(device_template_variables[property]) != str(current_variables[property]):
-                        viptela.result['changed'] = True
+                if variables_changed(device_template_variables, current_variables):
+                    viptela.result['changed'] = True
         else:
             viptela.result['changed'] = True
 
@@ -205,7 +379,7 @@ def run_module():
 
     elif viptela.params['state'] == 'query':
         # Get template data and see if it is a real template
-        device_template_dict = viptela.get_device_template_dict(factory_default=True)
+        device_template_dict = viptela.get_device_template_dict(factory_default=True, fields=['templateId'])
         if viptela.params['template']:
             if viptela.params['template'] not in device_template_dict:
                 viptela.fail_json(msg='Template {0} not found.'.format(viptela.params['template']))
@@ -213,12 +387,11 @@ def run_module():
         else:
             viptela.fail_json(msg='Must specify a template with state query')
 
-        # get_template_variables provides a variable name -> property mapping
-        template_variables = viptela.get_template_variables(device_template_dict[viptela.params['template']]['templateId'])
-        optional_template_variables = viptela.get_template_optional_variables(device_template_dict[viptela.params['template']]['templateId'])
-        viptela.result['template_variables'] = template_variables
-        viptela.result['optional_template_variables'] = optional_template_variables
-        viptela.result['mandatory_template_variables'] = {k: template_variables[k] for k in set(template_variables) - set(optional_template_variables)}
+        # get_template_schema provides variable name -> property mappings from a single input fetch
+        template_schema = viptela.get_template_schema(template_data['templateId'])
+        viptela.result['template_variables'] = template_schema['variables']
+        viptela.result['optional_template_variables'] = template_schema['optional_variables']
+        viptela.result['mandatory_template_variables'] = template_schema['mandatory_variables']
     # If told, wait for the status of the request and report it
     if viptela.params['wait'] and action_id:
         viptela.waitfor_action_completion(action_id)
@@ -6,9 +6,84 @@ ANSIBLE_METADATA = {
     'supported_by': 'community'
 }
 
+import os
 from ansible.module_utils.basic import AnsibleModule, json
 from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
 
+# We can only generate bootstrap in these two states.  Otherwise, the device is in-use and cannot be bootstrapped.
+BOOTSTRAP_STATES = ['tokengenerated', 'bootstrapconfiggenerated']
+
+
+def select_devices(viptela, device_index):
+    """Pick the devices to bootstrap out of the inventory: the listed names or UUIDs, then `count`
+    unused (tokengenerated) devices of each model."""
+    selected = []
+    missing = []
+    for name in viptela.params['devices'] or []:
+        device = device_index['uuid'].get(name) or device_index['host-name'].get(name)
+        if device:
+            selected.append(device)
+        else:
+            missing.append(name)
+    if missing:
+        viptela.fail_json(msg="Could not find devices: {0}".format(', '.join(missing)))
+
+    models = dict(viptela.params['models'] or {})
+    if viptela.params['model'] and viptela.params['count']:
+        models[viptela.params['model']] = viptela.params['count']
+    selected_uuids = set(device['uuid'] for device in selected)
+    for model, count in models.items():
+        unused = [device for device in device_index['uuid'].values()
+                  if device.get('deviceModel') == model and device.get('vedgeCertificateState') == 'tokengenerated'
+                  and device['uuid'] not in selected_uuids][:count]
+        if len(unused) < count:
+            viptela.fail_json(msg="Only {0} of {1} available devices found for model {2}".format(len(unused), count, model))
+        selected.extend(unused)
+        selected_uuids.update(device['uuid'] for device in unused)
+
+    return selected
+
+
+def run_bulk(viptela, module):
+    # One fetch of the inventory serves every lookup and allocation
+    device_index = viptela.get_device_index('vedges')
+    devices = select_devices(viptela, device_index)
+
+    uuids = []
+    viptela.result['skipped'] = []
+    for device in devices:
+        if device.get('vedgeCertificateState') in BOOTSTRAP_STATES:
+            uuids.append(device['uuid'])
+        else:
+            viptela.result['skipped'].append(device['uuid'])
+
+    viptela.result['bootstraps'] = [{'uuid': uuid} for uuid in uuids]
+    if uuids:
+        viptela.result['what_changed'].append('bootstrap')
+    if module.check_mode or not uuids:
+        return
+
+    dest = viptela.params['dest']
+    if dest and not os.path.isdir(dest):
+        os.makedirs(dest)
+
+    errors = []
+    viptela.result['bootstraps'] = []
+    for bootstrap in viptela.generate_bootstraps(uuids):
+        if bootstrap.pop('error'):
+            errors.append(bootstrap['uuid'])
+            continue
+        if dest:
+            # The configs go to files rather than into the result, which stays small
+            bootstrap['file'] = os.path.join(dest, '{0}.cfg'.format(bootstrap['uuid']))
+            with open(bootstrap['file'], 'w') as f:
+                f.write(bootstrap.pop('bootstrapConfig'))
+        viptela.result['bootstraps'].append(bootstrap)
+
+    if errors:
+        viptela.fail_json(msg="Could not generate bootstrap for UUIDs: {0}".format(', '.join(errors)))
+
+
 def run_module():
     # define available arguments/parameters a user can pass to the module
     argument_spec = viptela_argument_spec()
@@ -16,6 +91,10 @@ def run_module():
                          device_ip=dict(type='str', alias='deviceIP'),
                          uuid=dict(type='str'),
                          model=dict(type='str'),
+                         devices=dict(type='list'),
+                         count=dict(type='int'),
+                         models=dict(type='dict'),
+                         dest=dict(type='path'),
                          )
 
     # seed the result dict in the object
@@ -37,6 +116,14 @@ def run_module():
     viptela = viptelaModule(module)
     viptela.result['what_changed'] = []
     viptela.result['bootstrap'] = {}
+    if viptela.params['count'] and not viptela.params['model']:
+        # model on its own still picks a single free device, so this is not a required_together pair
+        viptela.fail_json(msg="count requires model")
+    if viptela.params['devices'] or viptela.params['count'] or viptela.params['models']:
+        run_bulk(viptela, module)
+        viptela.result['changed'] = bool(viptela.result['what_changed'])
+        viptela.exit_json(**viptela.result)
+
     device = {}
     uuid = None
     if viptela.params['uuid']:
@@ -53,9 +140,7 @@ def run_module():
             uuid = device['uuid']
 
     if uuid:
-        if device['vedgeCertificateState'] in ['tokengenerated', 'bootstrapconfiggenerated']:
-            # We can only generate bootstrap in these two states.  Otherwise, the
-            # device is in-use and cannot be bootstrapped.
+        if device['vedgeCertificateState'] in BOOTSTRAP_STATES:
             viptela.result['what_changed'].append('bootstrap')
             if not module.check_mode:
                 bootstrap = viptela.generate_bootstrap(uuid)
@@ -10,11 +10,43 @@ import requests
 from ansible.module_utils.basic import AnsibleModule, json
 from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
 
+DEVICE_TYPES = ['vedges', 'controllers']
+
+
+def get_device_facts(viptela, include_fields=None, key_by=None, include_status=False):
+    """Fetch the device inventories, and with include_status the device status merged into each device, together."""
+    request_list = [('/dataservice/system/device/{0}'.format(device_type), 'GET', None) for device_type in DEVICE_TYPES]
+    if include_status:
+        request_list.append(('/dataservice/device', 'GET', None))
+    responses = viptela.request_many(request_list, fail_on_error=True)
+    status = {}
+    if include_status:
+        status = dict((device['uuid'], device) for device in responses[-1].json.get('data', []) if 'uuid' in device)
+
+    facts = {}
+    for device_type, response in zip(DEVICE_TYPES, responses):
+        device_list = []
+        for device in response.json.get('data', []):
+            device_facts = dict(status.get(device.get('uuid'), {}))
+            device_facts.update(device)
+            if include_fields:
+                device_facts = dict((field, device_facts[field]) for field in include_fields if field in device_facts)
+            device_list.append(device_facts)
+
+        if key_by:
+            facts[device_type] = viptela.list_to_dict(device_list, key_name=key_by, remove_key=False)
+        else:
+            facts[device_type] = device_list
+    return facts
+
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
     argument_spec = viptela_argument_spec()
     argument_spec.update(factory_default=dict(type='bool', default=False),
+                         include_fields=dict(type='list'),
+                         key_by=dict(type='str'),
+                         include_status=dict(type='bool', default=False),
                          )
 
     # seed the result dict in the object
@@ -37,8 +69,13 @@ def run_module():
                            )
     viptela = viptelaModule(module)
 
-    viptela.result['vedges'] = viptela.get_device_list('vedges')
-    viptela.result['controllers'] = viptela.get_device_list('controllers')
+    include_fields = viptela.params['include_fields']
+    key_by = viptela.params['key_by']
+    if include_fields and key_by and key_by not in include_fields:
+        include_fields = include_fields + [key_by]
+
+    viptela.result.update(get_device_facts(viptela, include_fields=include_fields, key_by=key_by,
+                                           include_status=viptela.params['include_status']))
 
     viptela.exit_json(**viptela.result)
 
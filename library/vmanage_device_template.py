@@ -64,7 +64,7 @@ def run_module():
                 }
             ]
 
-    device_template_dict = viptela.get_device_template_dict(factory_default=True, remove_key=False)
+    device_template_dict = viptela.get_device_template_dict(factory_default=True, remove_key=False, fields=['templateId'])
 
     compare_values = ['templateDescription', 'deviceType', 'configType', 'generalTemplates']
     ignore_values = ["lastUpdatedOn", "lastUpdatedBy", "templateId", "createdOn", "createdBy"]
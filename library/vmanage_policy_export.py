@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+from ansible.module_utils.basic import AnsibleModule, json
+from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = viptela_argument_spec()
+    argument_spec.update(file = dict(type='str', required=True),
+                         )
+
+    # seed the result dict in the object
+    # we primarily care about changed and state
+    # change is if this module effectively modified the target
+    # state will include any data that you want your module to pass back
+    # for consumption, for example, in a subsequent task
+    result = dict(
+        changed=False,
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(argument_spec=argument_spec,
+                           supports_check_mode=True,
+                           )
+    viptela = viptelaModule(module)
+
+    # Lists, definitions and central policies keep their IDs so that vmanage_policy_import can rebuild
+    # the references between them on another vManage
+    policy_export = viptela.get_policy_bundle()
+
+    if not module.check_mode:
+        with open(viptela.params['file'], 'w') as f:
+            json.dump(policy_export, f, indent=4, sort_keys=True)
+
+    viptela.result['policy_lists'] = len(policy_export['policy_lists'])
+    viptela.result['policy_definitions'] = len(policy_export['policy_definitions'])
+    viptela.result['central_policies'] = len(policy_export['central_policies'])
+
+    viptela.exit_json(**viptela.result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
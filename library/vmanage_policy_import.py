@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+import os
+import hashlib
+from ansible.module_utils.basic import AnsibleModule, json
+from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
+
+# The kinds of objects in a policy bundle (as written by vmanage_policy_export) and the fields that make
+# up their content.  Only these fields are compared and sent when an object is created.
+POLICY_BUNDLE_KINDS = [
+    {
+        'kind': 'policy_lists',
+        'id_key': 'listId',
+        'name_key': 'name',
+        'fields': ['name', 'description', 'type', 'entries'],
+    },
+    {
+        'kind': 'policy_definitions',
+        'id_key': 'definitionId',
+        'name_key': 'name',
+        'fields': ['name', 'description', 'type', 'sequences', 'defaultAction', 'definition'],
+    },
+    {
+        'kind': 'central_policies',
+        'id_key': 'policyId',
+        'name_key': 'policyName',
+        'fields': ['policyName', 'policyDescription', 'policyType', 'policyDefinition'],
+    },
+]
+
+
+def get_node_key(kind, data):
+    # Lists and definitions are unique per type, central policies by name
+    if kind['kind'] == 'central_policies':
+        return (kind['kind'], None, data[kind['name_key']])
+    return (kind['kind'], data['type'].lower(), data[kind['name_key']])
+
+
+def get_create_path(node):
+    if node['kind'] == 'policy_lists':
+        return '/dataservice/template/policy/list/{0}/'.format(node['key'][1])
+    elif node['kind'] == 'policy_definitions':
+        return '/dataservice/template/policy/definition/{0}/'.format(node['key'][1])
+    return '/dataservice/template/policy/vsmart'
+
+
+def find_references(value, ids):
+    """Return the IDs out of `ids` that appear anywhere in value."""
+    if isinstance(value, dict):
+        return set().union(*[find_references(item, ids) for item in value.values()]) if value else set()
+    elif isinstance(value, list):
+        return set().union(*[find_references(item, ids) for item in value]) if value else set()
+    elif value in ids:
+        return set([value])
+    return set()
+
+
+def replace_references(value, id_map):
+    if isinstance(value, dict):
+        return dict((key, replace_references(item, id_map)) for key, item in value.items())
+    elif isinstance(value, list):
+        return [replace_references(item, id_map) for item in value]
+    elif isinstance(value, (str, type(u''))) and value in id_map:
+        return id_map[value]
+    return value
+
+
+def content_hash(payload, labels):
+    # References are replaced by the type and name of the object they point to, so that the same
+    # content on two vManage instances hashes the same although the IDs differ.
+    content = json.dumps(replace_references(payload, labels), sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def get_levels(viptela, nodes):
+    """Group the nodes into dependency levels: each level only references nodes of earlier levels."""
+    ids = set(node['id'] for node in nodes)
+    dependencies = dict((node['id'], find_references(node['payload'], ids) - set([node['id']])) for node in nodes)
+
+    levels = []
+    done = set()
+    remaining = list(nodes)
+    while remaining:
+        level = [node for node in remaining if dependencies[node['id']] <= done]
+        if not level:
+            viptela.fail_json(msg='Circular references between policy objects: {0}'.format(
+                ', '.join(node['key'][2] for node in remaining)))
+        levels.append(level)
+        done.update(node['id'] for node in level)
+        remaining = [node for node in remaining if node['id'] not in done]
+
+    return levels
+
+
+def get_existing_objects(viptela, nodes):
+    """Return the objects on this vManage that have the same kind, type and name as a bundle object,
+    and the ID -> label index used to compare their content."""
+    existing = {}
+    labels = {}
+
+    for policy_list in viptela.get_policy_list_list('all'):
+        key = get_node_key(POLICY_BUNDLE_KINDS[0], policy_list)
+        existing[key] = policy_list
+        labels[policy_list['listId']] = '{0}:{1}:{2}'.format(*key)
+
+    definition_types = [node['key'][1] for node in nodes if node['kind'] == 'policy_definitions']
+    definition_ids = viptela.get_policy_definition_ids(definition_types)
+    for (type, name), definition_id in definition_ids.items():
+        labels[definition_id] = 'policy_definitions:{0}:{1}'.format(type, name)
+    existing_definitions = [node['key'] for node in nodes
+                            if node['kind'] == 'policy_definitions' and node['key'][1:] in definition_ids]
+    responses = viptela.request_many([('/dataservice/template/policy/definition/{0}/{1}'.format(type, definition_ids[(type, name)]), 'GET', None)
+                                      for kind, type, name in existing_definitions], fail_on_error=True)
+    for key, response in zip(existing_definitions, responses):
+        response.json['definitionId'] = definition_ids[key[1:]]
+        existing[key] = response.json
+
+    response = viptela.request('/dataservice/template/policy/vsmart')
+    for policy in response.json.get('data', []):
+        try:
+            policy['policyDefinition'] = json.loads(policy['policyDefinition'])
+        except (TypeError, ValueError):
+            pass
+        existing[get_node_key(POLICY_BUNDLE_KINDS[2], policy)] = policy
+
+    return existing, labels
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = viptela_argument_spec()
+    argument_spec.update(file = dict(type='str', required=True),
+    )
+
+    # seed the result dict in the object
+    # we primarily care about changed and state
+    # change is if this module effectively modified the target
+    # state will include any data that you want your module to pass back
+    # for consumption, for example, in a subsequent task
+    result = dict(
+        changed=False,
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(argument_spec=argument_spec,
+                           supports_check_mode=True,
+                           )
+    viptela = viptelaModule(module)
+
+    # Read in the datafile
+    if not os.path.exists(viptela.params['file']):
+        module.fail_json(msg='Cannot find file {0}'.format(viptela.params['file']))
+    with open(viptela.params['file']) as f:
+        policy_data = json.load(f)
+
+    nodes = []
+    for kind in POLICY_BUNDLE_KINDS:
+        for data in policy_data.get(kind['kind'], []):
+            nodes.append({
+                'kind': kind['kind'],
+                'id_key': kind['id_key'],
+                'id': data[kind['id_key']],
+                'key': get_node_key(kind, data),
+                'payload': dict((field, data[field]) for field in kind['fields'] if field in data),
+            })
+    source_labels = dict((node['id'], '{0}:{1}:{2}'.format(*node['key'])) for node in nodes)
+
+    existing, target_labels = get_existing_objects(viptela, nodes)
+
+    # Map the IDs in the bundle to the IDs on this vManage as objects are found or created
+    id_map = {}
+    viptela.result['created'] = []
+    viptela.result['skipped'] = []
+    viptela.result['conflicts'] = []
+    for level in get_levels(viptela, nodes):
+        new_nodes = []
+        for node in level:
+            if node['key'] in existing:
+                existing_data = existing[node['key']]
+                id_map[node['id']] = existing_data[node['id_key']]
+                existing_payload = dict((field, existing_data[field]) for field in node['payload'] if field in existing_data)
+                if content_hash(node['payload'], source_labels) == content_hash(existing_payload, target_labels):
+                    viptela.result['skipped'].append(node['key'][2])
+                else:
+                    # Objects with the same name but different content are left alone and reported
+                    viptela.result['conflicts'].append(node['key'][2])
+            else:
+                new_nodes.append(node)
+
+        # Everything in a level only depends on earlier levels, so a level is created concurrently
+        if new_nodes:
+            viptela.result['changed'] = True
+            viptela.result['created'].extend(node['key'][2] for node in new_nodes)
+            if not module.check_mode:
+                responses = viptela.request_many([(get_create_path(node), 'POST', replace_references(node['payload'], id_map))
+                                                  for node in new_nodes], fail_on_error=True)
+                for node, response in zip(new_nodes, responses):
+                    if response.json.get(node['id_key']):
+                        id_map[node['id']] = response.json[node['id_key']]
+
+    viptela.exit_json(**viptela.result)
+
+def main():
+    run_module()
+
+if __name__ == '__main__':
+    main()
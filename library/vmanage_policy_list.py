@@ -8,7 +8,7 @@ ANSIBLE_METADATA = {
 
 import os
 from ansible.module_utils.basic import AnsibleModule, json
-from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
+from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec, POLICY_LIST_AGGREGATE_TYPES, POLICY_LIST_ROUTE_PREFIX_TYPES
 
 
 def run_module():
@@ -22,6 +22,7 @@ def run_module():
                             'dataprefix', 'prefix', 'aspath', 'class', 'community', 'extcommunity', 'mirror', 'tloc',
                             'sla', 'policer', 'ipprefixall', 'dataprefixall'], default='all'),
                          entries = dict(type ='list'),
+                         aggregate_prefixes=dict(type='bool', default=False),
                          push=dict(type='bool', default=False),
                          force=dict(type='bool', default=False)
     )
@@ -61,15 +62,30 @@ def run_module():
 
     compare_values = ["name", "description", "type", "entries"]
 
+    # Templates affected by the updated lists are collected and reattached once, after every list is updated
+    affected_templates = []
+
     # Import site lists
     for list in policy_list:
         if viptela.params['state'] == 'present':
+            if viptela.params['aggregate_prefixes'] and list['type'].lower() in POLICY_LIST_ROUTE_PREFIX_TYPES:
+                viptela.fail_json(msg="aggregate_prefixes cannot be used on {0} list {1}: merging route prefixes changes "
+                                      "the routes they match".format(list['type'], list['name']))
+            if viptela.params['aggregate_prefixes'] and list['type'].lower() in POLICY_LIST_AGGREGATE_TYPES and list['entries']:
+                list['entries'], removed = viptela.aggregate_policy_list_prefixes(list['entries'])
+                viptela.result.setdefault('aggregated_entries', {})[list['name']] = removed
             if list['name'] in policy_list_dict:
                 # FIXME Just compare the entries for now.
-                if (list['entries'] != policy_list_dict[list['name']]['entries']) or viptela.params['force']:
+                # The entries are normalized and compared as sets, so a reordering by vManage is not a change.
+                entries_diff = viptela.compare_policy_list_entries(list['entries'], policy_list_dict[list['name']]['entries'])
+                if entries_diff['changed'] or viptela.params['force']:
                     list['listId'] = policy_list_dict[list['name']]['listId']
                     viptela.result['new_entries'] = list['entries']
                     viptela.result['existing_entries'] = policy_list_dict[list['name']]['entries']
+                    viptela.result.setdefault('entries_diff', {})[list['name']] = {
+                        'added': entries_diff['added'],
+                        'removed': entries_diff['removed'],
+                    }
                     # If description is not specified, try to get it from the existing information
                     if not list['description']:
                         list['description'] = policy_list_dict[list['name']]['description']
@@ -85,10 +101,9 @@ def run_module():
                             if 'processId' in response.json:
                                 process_id = response.json['processId']
                                 viptela.result['put_payload'] = response.json['processId']
-                                if viptela.params['push']:
-                                    # If told to push out the change, we need to reattach each template affected by the change
-                                    for template_id in response.json['masterTemplatesAffected']:
-                                        action_id = viptela.reattach_device_template(template_id, process_id=process_id)
+                                for template_id in response.json.get('masterTemplatesAffected', []):
+                                    if template_id not in affected_templates:
+                                        affected_templates.append(template_id)
 
                                 # Delete the lock on the policy list
                                 # FIXME: The list does not seem to update when we unlock too soon, so I think that we need
@@ -110,6 +125,10 @@ def run_module():
                                     method='DELETE')
                 viptela.result['changed'] = True
 
+    if viptela.params['push'] and affected_templates:
+        # If told to push out the change, we need to reattach each template affected by the changes
+        viptela.result['templates_reattached'] = viptela.reattach_device_templates(affected_templates)
+
     viptela.logout()
     viptela.exit_json(**viptela.result)
 
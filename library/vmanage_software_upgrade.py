@@ -7,9 +7,73 @@ ANSIBLE_METADATA = {
 }
 
 from ansible.module_utils.basic import AnsibleModule, json
-from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
+from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec, viptela_wait_argument_spec
 from collections import OrderedDict
 
+
+def plan_waves(devices, site_ids, canaries, wave_size):
+    """Split the devices into upgrade waves of at most wave_size devices.
+
+    Canaries make up the first wave(s) on their own.  When site_ids is given, a wave never holds two
+    devices of the same site, so redundant edges of a site are upgraded one after the other.  The sites
+    with the most devices left are served first, which keeps the number of waves down to the size of
+    the largest site where the wave size allows it.
+    """
+    waves = []
+    canary_devices = [device for device in devices if device['deviceIP'] in canaries]
+    other_devices = [device for device in devices if device['deviceIP'] not in canaries]
+    for group in [canary_devices, other_devices]:
+        sites = OrderedDict()
+        for device in group:
+            # Devices without a known site do not constrain any other device
+            site_id = site_ids.get(device['deviceIP']) if site_ids is not None else None
+            if site_id is None:
+                site_id = ('device', device['deviceIP']) if site_ids is not None else 'all'
+            sites.setdefault(site_id, []).append(device)
+
+        while sites:
+            if site_ids is None:
+                wave = sites['all'][:wave_size]
+                sites['all'] = sites['all'][wave_size:]
+            else:
+                wave = []
+                for site_id in sorted(sites, key=lambda site_id: len(sites[site_id]), reverse=True)[:wave_size]:
+                    wave.append(sites[site_id].pop(0))
+            waves.append(wave)
+            sites = OrderedDict((site_id, site_devices) for site_id, site_devices in sites.items() if site_devices)
+
+    return waves
+
+
+def run_wave(viptela, wave, deviceType, data, reboot):
+    """Install the software on one wave, split into actions of batch_size devices that are waited on together.
+
+    Returns the action summaries and the IPs of the devices that failed or did not finish.
+    """
+    batch_size = viptela.params['batch_size'] or len(wave)
+    batches = [wave[index:index + batch_size] for index in range(0, len(wave), batch_size)]
+    responses = viptela.request_many([('/dataservice/device/action/install', 'POST',
+                                       viptela.software_install_payload(batch, deviceType, data, reboot))
+                                      for batch in batches], fail_on_error=True)
+    action_ids = []
+    for response in responses:
+        if not response.json or 'id' not in response.json:
+            viptela.fail_json(msg='Did not get action ID after installing software.')
+        action_ids.append(response.json['id'])
+
+    actions = viptela.poll_actions(action_ids)
+    summaries = OrderedDict()
+    failed_devices = []
+    for batch, (action_id, action) in zip(batches, actions.items()):
+        summaries[action_id] = viptela.get_action_summary(action)
+        if action['error'] or not action['complete']:
+            failed_devices.extend(device['deviceIP'] for device in batch)
+        else:
+            failed_devices.extend(device['system-ip'] for device in summaries[action_id]['devices']
+                                  if device['statusId'] == 'failure')
+    return summaries, failed_devices
+
+
 def run_module():
     # define available arguments/parameters a user can pass to the module
     argument_spec = viptela_argument_spec()
@@ -17,8 +81,14 @@ def run_module():
                          deviceType=dict(type='str', choices=['controller', 'vedge'], default='vedge'),
                          version=dict(type='str'),
                          activate=dict(type='bool'),
-                         set_default=dict(type='bool')
+                         set_default=dict(type='bool'),
+                         batch_size=dict(type='int'),
+                         max_concurrent_actions=dict(type='int', default=1),
+                         canaries=dict(type='list', default=[]),
+                         group_by_site=dict(type='bool', default=True),
+                         max_failure_rate=dict(type='float', default=0),
                          )
+    argument_spec.update(viptela_wait_argument_spec())
 
     # seed the result dict in the object
     # we primarily care about changed and state
@@ -65,12 +135,45 @@ def run_module():
 
     # If we have found the software we can move on and perform the operation
     if software_present_on_vManage:
-        viptela.software_install(devices,deviceType,data,reboot)
-
-        if set_default:
-            for device in devices:
-                device.update({'version': version})
-            viptela.set_default_partition(devices,deviceType)
+        # Upgrade in waves of max_concurrent_actions actions with batch_size devices each.  Without a
+        # batch size, every device goes into one action as long as no two of them share a site.
+        if viptela.params['batch_size']:
+            wave_size = max(1, viptela.params['batch_size']) * max(1, viptela.params['max_concurrent_actions'])
+        else:
+            wave_size = len(devices)
+        site_ids = None
+        if viptela.params['group_by_site']:
+            device_status = viptela.get_device_status_dict(key_name='system-ip')
+            site_ids = dict((device['deviceIP'], device_status.get(device['deviceIP'], {}).get('site-id'))
+                            for device in devices)
+        waves = plan_waves(devices, site_ids, viptela.params['canaries'], max(1, wave_size))
+
+        viptela.result['changed'] = True
+        viptela.result['waves'] = [{'devices': [device['deviceIP'] for device in wave]} for wave in waves]
+        viptela.result['failed_devices'] = []
+        viptela.result['halted'] = False
+        if module.check_mode:
+            viptela.exit_json(**viptela.result)
+
+        attempted = 0
+        for index, wave in enumerate(waves):
+            actions, failed_devices = run_wave(viptela, wave, deviceType, data, reboot)
+            viptela.result['waves'][index].update(actions=actions, failed_devices=failed_devices)
+            viptela.result['failed_devices'].extend(failed_devices)
+            attempted += len(wave)
+
+            if set_default:
+                upgraded = [dict(device, version=version) for device in wave if device['deviceIP'] not in failed_devices]
+                if upgraded:
+                    viptela.set_default_partition(upgraded, deviceType)
+
+            # Stop before the next wave once too much of the fabric failed to upgrade
+            failure_rate = 100.0 * len(viptela.result['failed_devices']) / attempted
+            if failure_rate > viptela.params['max_failure_rate']:
+                viptela.result['halted'] = index < len(waves) - 1
+                viptela.fail_json(msg="{0} of {1} devices failed to upgrade ({2:.1f}%), halted after wave {3} of {4}".format(
+                    len(viptela.result['failed_devices']), attempted, failure_rate, index + 1, len(waves)),
+                    pending_devices=[device['deviceIP'] for pending_wave in waves[index + 1:] for device in pending_wave])
 
     # If not, we fail
     else:
@@ -7,16 +7,93 @@ ANSIBLE_METADATA = {
 }
 #### CAN WE DO THIS ????
 import os
+import hashlib
+import tempfile
 from ansible.module_utils.basic import AnsibleModule, json
-from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec
+from ansible.module_utils.viptela import viptelaModule, viptela_argument_spec, UPLOAD_CHUNK_SIZE
 from collections import OrderedDict
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SOFTWARE_MANIFEST = '~/.ansible/vmanage_software_manifest.json'
+
+
+def read_manifest(path):
+    """Return the local record of image checksums and of what was uploaded to which vManage."""
+    manifest = {'files': {}, 'uploads': {}}
+    try:
+        with open(path) as f:
+            manifest.update(json.load(f))
+    except (IOError, OSError, ValueError):
+        pass
+    return manifest
+
+
+def lock_manifest(path):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    lock_file = open('{0}.lock'.format(path), 'a')
+    if fcntl:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+def write_manifest(path, manifest):
+    # Runs against several vManages share the manifest, so the entries are merged into the current file under
+    # a lock instead of overwriting what the other runs wrote since this one read it
+    lock_file = lock_manifest(path)
+    try:
+        current = read_manifest(path)
+        current['files'].update(manifest['files'])
+        for host, uploads in manifest['uploads'].items():
+            current['uploads'].setdefault(host, {}).update(uploads)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        os.rename(temp_path, path)
+    finally:
+        lock_file.close()
+
+
+def get_checksum(manifest, path):
+    # Hashing a multi-GB image takes a while, so the checksum is reused while size and mtime are unchanged
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    cached = manifest['files'].get(path)
+    if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+        return cached['sha256']
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    manifest['files'][path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256.hexdigest()}
+    return manifest['files'][path]['sha256']
+
+
+def log_progress(module):
+    # Log every 10% of each upload, as a module has no other way to report progress while it runs
+    logged = {}
+
+    def progress(path, sent, total):
+        step = 10 * sent // total if total else 10
+        if step > logged.get(path, -1):
+            logged[path] = step
+            module.log('Uploading {0}: {1}%'.format(os.path.basename(path), step * 10))
+    return progress
+
+
 def run_module():
     # define available arguments/parameters a user can pass to the module
     argument_spec = viptela_argument_spec()
     argument_spec.update(state=dict(type='str', choices=['absent', 'present'], default='present'),
                          file=dict(type='str'),
-                         aggregate=dict(type='list')
+                         aggregate=dict(type='list'),
+                         manifest=dict(type='path', default=SOFTWARE_MANIFEST),
                          )
 
     # seed the result dict in the object
@@ -62,35 +139,61 @@ def run_module():
     vManage_software_list = viptela.get_software_images_list()
 
     if viptela.params['state'] == 'present':
+        available_files = set()
+        for software in vManage_software_list:
+            available_files.update(software["availableFiles"].split(', '))
 
-        for software_to_upload in upload_software_list:
+        # Images are also recognised by checksum, so that a renamed copy of an uploaded image is skipped
+        manifest_path = os.path.expanduser(viptela.params['manifest'])
+        manifest = read_manifest(manifest_path)
+        uploads = manifest['uploads'].setdefault(viptela.host, {})
 
-            try:
-                present = False
-                path_software_to_be_uploaded = software_to_upload['file']
-
-                if not os.path.exists(path_software_to_be_uploaded):
-                    module.fail_json(
-                        msg="File does not exists")
-
-                filename_software_to_be_uploaded = os.path.basename(path_software_to_be_uploaded)
-
-                for software in vManage_software_list:
-                    availabe_files_list = software["availableFiles"].split(', ')
-                    if filename_software_to_be_uploaded in availabe_files_list:
-                        present = True
-
-
-                if not module.check_mode and not present:
-                    response = viptela.request('/dataservice/device/action/software/package', method='POST',
-                                               files={'file': open(path_software_to_be_uploaded, 'rb')},
-                                               data={'validity':'valid', 'upload':'true'},
-                                               headers=None)
+        checksums = OrderedDict()
+        for software_to_upload in upload_software_list:
+            path_software_to_be_uploaded = software_to_upload['file']
 
-                    viptela.result['changed'] = True
-            except Exception as e:
+            if not os.path.exists(path_software_to_be_uploaded):
                 module.fail_json(
-                    msg="General Error {0}".format(e))
+                    msg="File does not exists")
+
+            checksum = get_checksum(manifest, path_software_to_be_uploaded)
+            checksums[path_software_to_be_uploaded] = checksum
+            # Remember the images found by name, so that copies of them under another name are found too
+            if os.path.basename(path_software_to_be_uploaded) in available_files:
+                uploads[checksum] = os.path.basename(path_software_to_be_uploaded)
+
+        to_upload = OrderedDict()
+        viptela.result['skipped'] = []
+        for path_software_to_be_uploaded, checksum in checksums.items():
+            if uploads.get(checksum) in available_files:
+                viptela.result['skipped'].append(path_software_to_be_uploaded)
+            elif checksum not in to_upload.values():
+                to_upload[path_software_to_be_uploaded] = checksum
+
+        viptela.result['uploaded'] = list(to_upload)
+        if to_upload:
+            viptela.result['changed'] = True
+
+        errors = []
+        if not module.check_mode and to_upload:
+            # The images are streamed from disk, at most `concurrency` of them at a time
+            responses = viptela.upload_files('/dataservice/device/action/software/package', list(to_upload),
+                                             fields={'validity': 'valid', 'upload': 'true'},
+                                             progress=log_progress(module))
+            for (path, checksum), response in zip(to_upload.items(), responses):
+                if response.error:
+                    errors.append('{0}: {1}'.format(path, response.error))
+                else:
+                    uploads[checksum] = os.path.basename(path)
+            viptela.result['uploaded'] = [path for path, response in zip(to_upload, responses) if not response.error]
+
+        if not module.check_mode:
+            try:
+                write_manifest(manifest_path, manifest)
+            except (IOError, OSError) as e:
+                module.warn('Could not write the software manifest {0}: {1}'.format(manifest_path, e))
+        if errors:
+            viptela.fail_json(msg='{0} of {1} uploads failed'.format(len(errors), len(to_upload)), errors=errors)
 
     else:
         # absent to be added
@@ -46,7 +46,7 @@ def run_module():
     device_template_data = template_data['device_templates']
 
     # Process the feature templates
-    feature_templates = viptela.get_feature_template_dict(factory_default=True)
+    feature_templates = viptela.get_feature_template_ids()
     for data in feature_template_data:
         if data['templateName'] not in feature_templates:
             payload = {
@@ -64,10 +64,12 @@ def run_module():
             # Don't make the actual POST if we are in check mode
             if not module.check_mode:
                 response = viptela.request('/dataservice/template/feature/', method='POST', data=json.dumps(payload))
+                # Keep the name -> ID cache current so device templates can reference the new template
+                viptela.add_feature_template_id(data['templateName'], response.json.get('templateId'))
             viptela.result['changed'] = True
 
     # Process the device templates
-    device_templates = viptela.get_device_template_dict()
+    device_templates = viptela.get_device_template_dict(fields=['templateId'])
     for device_template in device_template_data:
         if device_template['templateName'] not in device_templates:
             payload = {
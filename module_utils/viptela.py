@@ -1,10 +1,18 @@
 # from __future__ import absolute_import, division, generate_function
 # __metaclass__ = type
 import json
+import os
+import hashlib
+import binascii
+import ipaddress
 import requests
 import re
+import random
 import time
+from multiprocessing.pool import ThreadPool
 from ansible.module_utils.basic import AnsibleModule, json, env_fallback
+from ansible.module_utils._text import to_text
+from ansible.module_utils.connection import Connection, ConnectionError
 from collections import OrderedDict
 
 try:
@@ -12,21 +20,164 @@ try:
 except ImportError:
     JSONDecodeError = ValueError
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 def viptela_argument_spec():
-    return dict(host=dict(type='str', required=True, fallback=(env_fallback, ['VMANAGE_HOST'])),
-            user=dict(type='str', required=True, fallback=(env_fallback, ['VMANAGE_USER'])),
-            password=dict(type='str', required=True, fallback=(env_fallback, ['VMANAGE_PASSWORD'])),
+    # host, user and password are only required when the task does not run over the vmanage httpapi connection
+    return dict(host=dict(type='str', required=False, fallback=(env_fallback, ['VMANAGE_HOST'])),
+            user=dict(type='str', required=False, fallback=(env_fallback, ['VMANAGE_USER'])),
+            password=dict(type='str', required=False, fallback=(env_fallback, ['VMANAGE_PASSWORD'])),
             validate_certs=dict(type='bool', required=False, default=False),
-            timeout=dict(type='int', default=30)
+            timeout=dict(type='int', default=30),
+            concurrency=dict(type='int', default=8),
+            session_cache=dict(type='bool', required=False, fallback=(env_fallback, ['VMANAGE_SESSION_CACHE'])),
+            session_cache_dir=dict(type='path', required=False, fallback=(env_fallback, ['VMANAGE_SESSION_CACHE_DIR']))
+    )
+
+def viptela_wait_argument_spec():
+    return dict(wait_timeout=dict(type='int', default=3600),
+            poll_interval=dict(type='float', default=1),
+            max_poll_interval=dict(type='float', default=10)
     )
 
 STANDARD_HTTP_TIMEOUT = 10
 STANDARD_JSON_HEADER = {'Connection': 'keep-alive', 'Content-Type': 'application/json'}
-POLICY_LIST_DICT = {
-    'siteLists': 'site',
-    'vpnLists': 'vpn',
-}
+# Policy list entry keys that are compared as canonical CIDRs and as numeric ranges
+POLICY_LIST_PREFIX_KEYS = ['ipPrefix', 'ipv6Prefix']
+POLICY_LIST_RANGE_KEYS = ['siteId', 'vpn']
+# Address-match prefix lists cover the addresses of their prefixes, so overlapping prefixes can be merged.
+# Route prefix lists match the prefixes themselves, so they must never be aggregated.
+POLICY_LIST_AGGREGATE_TYPES = ['dataprefix', 'dataipv6prefix', 'dataprefixall']
+POLICY_LIST_ROUTE_PREFIX_TYPES = ['prefix', 'ipv6prefix', 'ipprefixall']
+# Keys of central policy assembly entries that hold policy list IDs, e.g. siteLists or vpnLists
+POLICY_LIST_KEY_REGEX = re.compile(r'^(?P<type>.*)Lists$')
 VALID_STATUS_CODES = [200, 201, 202, 203, 204, 205, 206, 207, 208, 226]
+REQUIRED_CONNECTION_PARAMS = ['host', 'user', 'password']
+SESSION_CACHE_DIR = '~/.ansible/vmanage_sessions'
+SESSION_EXPIRED_STATUS_CODES = [401, 403]
+ACTION_WAIT_DEFAULTS = viptela_wait_argument_spec()
+ACTION_TERMINAL_STATUSES = ['success', 'failure']
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Device inventory keys that devices can be looked up by (vManage spells the chassis number chasisNumber)
+DEVICE_INDEX_KEYS = ['host-name', 'system-ip', 'uuid', 'deviceIP', 'chasisNumber', 'serialNumber']
+# Keys that /system/device/{type} filters on, and keys that /device filters on to give the uuid of a device
+DEVICE_QUERY_KEYS = ['uuid', 'deviceIP']
+DEVICE_STATUS_QUERY_KEYS = ['host-name', 'system-ip']
+
+# Template input columns carry the variable name in parentheses at the end of their title
+TEMPLATE_VARIABLE_REGEX = re.compile(r'\((?P<variable>[^(]+)\)')
+# vManage does not mark the attributes of a static route, vrrp group or logging server as optional when
+# the instance itself has been marked optional.  Each rule's `parent` matches the column that makes an
+# instance optional and captures the instance path; `children` matches the remainder of the property
+# of the attributes under that path.  These can be removed once the API marks the attributes itself.
+OPTIONAL_PARENT_RULES = [
+    {
+        'name': 'static route',
+        'parent': re.compile(r'^(?P<instance>.*/vpn-instance/ip/route/.+)/prefix$'),
+        'children': re.compile(r'^/next-hop/.+/address$'),
+    },
+    {
+        'name': 'vrrp',
+        'parent': re.compile(r'^(?P<instance>.*/vrrp/.+)/grp-id$'),
+        'children': re.compile(r'^/(priority|timer|track-prefix-list|ipv4/address|track-omp)$'),
+    },
+    {
+        'name': 'logging server',
+        'parent': re.compile(r'^(?P<instance>///logging/server/.+)/name$'),
+        'children': re.compile(r'^/(source-interface|vpn|priority)$'),
+    },
+]
+
+class ConnectionResponse(object):
+    """The parts of a requests.Response that request() uses, built from an httpapi connection reply."""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text or ''
+        self.content = self.text.encode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class StreamingMultipartEncoder(object):
+    """A multipart/form-data body with one file that is read from disk in chunks while it is sent.
+
+    requests streams any iterable body that has a length, so memory use stays at one chunk however
+    large the file is.  progress(sent, total) is called after every chunk.
+    """
+
+    def __init__(self, path, fields=None, file_field='file', progress=None, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.path = path
+        self.progress = progress
+        self.chunk_size = chunk_size
+        boundary = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.content_type = 'multipart/form-data; boundary={0}'.format(boundary)
+
+        head = ''
+        for name, value in (fields or {}).items():
+            head += '--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n{2}\r\n'.format(boundary, name, value)
+        head += '--{0}\r\nContent-Disposition: form-data; name="{1}"; filename="{2}"\r\n' \
+                'Content-Type: application/octet-stream\r\n\r\n'.format(boundary, file_field, os.path.basename(path))
+        self._head = head.encode('utf-8')
+        self._tail = '\r\n--{0}--\r\n'.format(boundary).encode('utf-8')
+        self._file_size = os.path.getsize(path)
+        self.len = len(self._head) + self._file_size + len(self._tail)
+        self._file = None
+        self._position = 0
+
+    def __len__(self):
+        return self.len
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def seek(self, offset, whence=0):
+        # Only rewinding is supported, e.g. to send the body again after logging in again
+        if offset != 0 or whence != 0:
+            raise IOError('StreamingMultipartEncoder can only seek to the start')
+        self.close()
+        self._position = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len - self._position
+        file_end = len(self._head) + self._file_size
+        chunks = []
+        while size > 0 and self._position < self.len:
+            if self._position < len(self._head):
+                chunk = self._head[self._position:self._position + size]
+            elif self._position < file_end:
+                if self._file is None:
+                    self._file = open(self.path, 'rb')
+                    self._file.seek(self._position - len(self._head))
+                chunk = self._file.read(min(size, file_end - self._position))
+                if not chunk:
+                    raise IOError('{0} changed size while it was being uploaded'.format(self.path))
+            else:
+                chunk = self._tail[self._position - file_end:self._position - file_end + size]
+            chunks.append(chunk)
+            self._position += len(chunk)
+            size -= len(chunk)
+
+        if self._position >= self.len:
+            self.close()
+        if chunks and self.progress:
+            self.progress(self._position, self.len)
+        return b''.join(chunks)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
 
 class viptelaModule(object):
 
@@ -50,9 +201,43 @@ class viptelaModule(object):
         self.host = self.params['host']
         self.timeout = self.params['timeout']
         self.modifiable_methods = ['POST', 'PUT', 'DELETE']
-
+        # Per-run name -> ID caches, filled on first use
+        self.feature_template_ids = None
+        self.policy_list_ids = None
+        self.policy_definition_ids = None
+        self.policy_definition_types = None
+        self.device_index = {}
+
+        self.concurrency = max(1, self.params['concurrency'])
         self.session = requests.Session()
         self.session.verify = self.params['validate_certs']
+        # Size the connection pool for request_many() so that concurrent requests reuse connections
+        # instead of opening (and throwing away) one per request.
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('https://', adapter)
+        self.logged_in = False
+
+        # When the task runs over the vmanage httpapi connection, ansible-connection already holds an
+        # authenticated session for the whole play and request() is sent through it.
+        self.connection = None
+        if getattr(module, '_socket_path', None):
+            self.connection = Connection(module._socket_path)
+            if not self.host:
+                self.host = self._get_connection_option('host')
+            if not self.user:
+                self.user = self._get_connection_option('remote_user')
+        else:
+            missing = [param for param in REQUIRED_CONNECTION_PARAMS if not self.params[param]]
+            if missing:
+                self.module.fail_json(msg='missing required arguments: {0}'.format(', '.join(missing)))
+
+        # The session cache lets several module invocations share one vManage session instead of
+        # logging in (and leaving a session behind) on every task.
+        self.session_cache_file = None
+        if self.params.get('session_cache') and not self.connection:
+            cache_dir = os.path.expanduser(self._fallback(self.params.get('session_cache_dir'), SESSION_CACHE_DIR))
+            cache_key = hashlib.sha1('{0}|{1}'.format(self.host, self.user).encode('utf-8')).hexdigest()
+            self.session_cache_file = os.path.join(cache_dir, 'vmanage-{0}.json'.format(cache_key))
 
         self.POLICY_DEFINITION_TYPES = ['cflowd', 'dnssecurity', 'control', 'hubandspoke', 'acl', 'vpnmembershipgroup',
                                         'mesh', 'rewriterule', 'data', 'rewriterule', 'aclv6']
@@ -61,7 +246,8 @@ class viptelaModule(object):
                                   'prefix', 'umbrelladata', 'class', 'ipssignature', 'dataprefixall',
                                   'urlblacklist', 'policer', 'urlwhitelist', 'vpn']
 
-        self.login()
+        if not self.connection:
+            self.login()
 
     # Deleting (Calling destructor)
     # def __del__(self):
@@ -98,9 +284,114 @@ class viptelaModule(object):
                     payload_key_diff.append(key)
         return payload_key_diff
 
+    @staticmethod
+    def normalize_policy_list_entry(entry):
+        """Return a hashable, canonical form of a policy list entry."""
+        normalized = []
+        for key, value in sorted(entry.items()):
+            value = to_text(value).strip()
+            if key in POLICY_LIST_PREFIX_KEYS:
+                try:
+                    value = to_text(ipaddress.ip_network(value, strict=False))
+                except ValueError:
+                    pass
+            elif key in POLICY_LIST_RANGE_KEYS:
+                try:
+                    bounds = [int(bound) for bound in value.split('-', 1)]
+                    value = (bounds[0], bounds[-1])
+                except ValueError:
+                    pass
+            normalized.append((key, value))
+        return tuple(normalized)
+
+    @staticmethod
+    def _merge_policy_list_ranges(normalized_entries):
+        # Site and VPN lists are equal when they cover the same numbers, however the ranges are split up
+        ranges = {}
+        for entry in normalized_entries:
+            if len(entry) != 1 or entry[0][0] not in POLICY_LIST_RANGE_KEYS or not isinstance(entry[0][1], tuple):
+                return None
+            ranges.setdefault(entry[0][0], []).append(entry[0][1])
+
+        merged = {}
+        for key, key_ranges in ranges.items():
+            merged[key] = []
+            for start, end in sorted(key_ranges):
+                if merged[key] and start <= merged[key][-1][1] + 1:
+                    merged[key][-1] = (merged[key][-1][0], max(end, merged[key][-1][1]))
+                else:
+                    merged[key].append((start, end))
+        return merged
+
+    def compare_policy_list_entries(self, new_entries, old_entries):
+        """Compare policy list entries regardless of order and formatting.
+
+        Returns a dict with whether the lists differ and the entries added and removed by the new list.
+        """
+        new_normalized = OrderedDict((self.normalize_policy_list_entry(entry), entry) for entry in new_entries or [])
+        old_normalized = OrderedDict((self.normalize_policy_list_entry(entry), entry) for entry in old_entries or [])
+
+        added = [entry for key, entry in new_normalized.items() if key not in old_normalized]
+        removed = [entry for key, entry in old_normalized.items() if key not in new_normalized]
+        changed = bool(added or removed)
+        if changed:
+            new_ranges = self._merge_policy_list_ranges(new_normalized)
+            if new_ranges is not None and new_ranges == self._merge_policy_list_ranges(old_normalized):
+                changed = False
+
+        return {'changed': changed, 'added': added, 'removed': removed}
+
+    @staticmethod
+    def aggregate_policy_list_prefixes(entries):
+        """Collapse adjacent and overlapping prefixes of a data prefix list into the minimal covering set.
+
+        Only entries that hold nothing but a prefix are merged; entries with a ge/le match or a prefix
+        that does not parse are kept as they are.  Returns the new entries and the number removed.
+        """
+        networks = OrderedDict()
+        aggregated = []
+        for entry in entries or []:
+            if len(entry) == 1 and list(entry)[0] in POLICY_LIST_PREFIX_KEYS:
+                key = list(entry)[0]
+                try:
+                    networks.setdefault(key, []).append(ipaddress.ip_network(to_text(entry[key]).strip(), strict=False))
+                    continue
+                except ValueError:
+                    pass
+            aggregated.append(entry)
+
+        for key, key_networks in networks.items():
+            # collapse_addresses only takes one address family at a time
+            for version in [4, 6]:
+                version_networks = [network for network in key_networks if network.version == version]
+                aggregated.extend({key: to_text(network)} for network in ipaddress.collapse_addresses(version_networks))
+
+        return aggregated, len(entries or []) - len(aggregated)
 
     def login(self):
+        if not self.session_cache_file:
+            return self._login()
+
+        # Hold the lock while deciding whether to log in so that parallel tasks against the
+        # same vManage do not all create a new session at once.
+        lock_file = self._lock_session_cache()
+        try:
+            cached_session = self._read_session_cache()
+            if cached_session and cached_session != self._get_session_state():
+                # Either nothing is loaded yet or another invocation already refreshed the session.
+                self._set_session_state(cached_session)
+                return None
+            response = self._login()
+            self._write_session_cache(self._get_session_state())
+        finally:
+            lock_file.close()
+
+        return response
+
+    def _login(self):
         # self.session.headers.update({'Connection': 'keep-alive', 'Content-Type': 'application/json'})
+        self.session.cookies.clear()
+        self.session.headers.pop('X-XSRF-TOKEN', None)
 
         try:
             response = self.session.post(
@@ -126,13 +417,137 @@ class viptelaModule(object):
             pass
         else:
             self.fail_json(msg='Failed getting X-XSRF-TOKEN: {0}'.format(response.status_code))
-        
+
+        self.logged_in = True
         return response
 
     def logout(self):
+        # A cached or httpapi session is meant to outlive this invocation, so leave it open.
+        if self.session_cache_file or self.connection:
+            return
         self.request('/dataservice/settings/clientSessionTimeout')
         self.request('/logout')
 
+    def _get_connection_option(self, option):
+        try:
+            return self.connection.get_option(option)
+        except ConnectionError as e:
+            self.module.fail_json(msg='Could not get {0} from the httpapi connection: {1}'.format(option, e))
+
+    def _send(self, method, url_path, data=None, files=None, headers=None, relogin=True):
+        if self.connection and files is None and not hasattr(data, 'read'):
+            status_code, text = self.connection.send_request(url_path, method=method, data=data)
+            return ConnectionResponse(status_code, text)
+
+        self._login_direct_session()
+
+        response = self.session.request(method, 'https://{0}{1}'.format(self.host, url_path), files=files, data=data,
+                                        headers=headers)
+
+        if relogin and self.session_cache_file and self._session_expired(response):
+            # The cached session timed out or was cleared on vManage, so log in again and retry once
+            self.login()
+            if hasattr(files, 'values'):
+                for file in files.values():
+                    if hasattr(file, 'seek'):
+                        file.seek(0)
+            if hasattr(data, 'seek'):
+                data.seek(0)
+            response = self.session.request(method, 'https://{0}{1}'.format(self.host, url_path), files=files, data=data,
+                                            headers=headers)
+
+        return response
+
+    def _login_direct_session(self):
+        if self.connection and not self.logged_in:
+            # Multipart uploads cannot be relayed through ansible-connection, so they get their own session
+            if not self.password:
+                self.password = self._get_connection_option('password')
+            self._login()
+
+    def _decode_response(self, response, status_codes=VALID_STATUS_CODES):
+        """Set response.json and return an error message if the status code is not acceptable."""
+        error_msg = None
+        if response.status_code not in status_codes:
+            decoded_response = {}
+            try:
+                decoded_response = response.json()
+            except JSONDecodeError:
+                pass
+
+            if 'error' in decoded_response:
+                error='Unknown'
+                details='Unknown'
+                if 'details' in decoded_response['error']:
+                    details = decoded_response['error']['details']
+                if 'message' in decoded_response['error']:
+                    error = decoded_response['error']['message']
+                error_msg = '{0}: {1}'.format(error, details)
+            else:
+                error_msg = requests.status_codes._codes[response.status_code][0]
+
+        try:
+            response.json = response.json()
+        except JSONDecodeError:
+            response.json = {}
+
+        return error_msg
+
+    def _get_session_state(self):
+        token = self.session.headers.get('X-XSRF-TOKEN')
+        if isinstance(token, bytes):
+            token = token.decode('utf-8')
+        return {
+            'cookies': requests.utils.dict_from_cookiejar(self.session.cookies),
+            'token': token
+        }
+
+    def _set_session_state(self, state):
+        self.session.cookies.clear()
+        requests.utils.add_dict_to_cookiejar(self.session.cookies, state.get('cookies', {}))
+        if state.get('token'):
+            self.session.headers['X-XSRF-TOKEN'] = state['token']
+        else:
+            self.session.headers.pop('X-XSRF-TOKEN', None)
+
+    def _lock_session_cache(self):
+        cache_dir = os.path.dirname(self.session_cache_file)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            lock_file = open('{0}.lock'.format(self.session_cache_file), 'a')
+        except (IOError, OSError) as e:
+            self.fail_json(msg='Could not open session cache {0}: {1}'.format(self.session_cache_file, e))
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _read_session_cache(self):
+        try:
+            with open(self.session_cache_file) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(state, dict) or not state.get('cookies'):
+            return None
+        return state
+
+    def _write_session_cache(self, state):
+        tmp_file = '{0}.{1}.tmp'.format(self.session_cache_file, os.getpid())
+        try:
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp_file, self.session_cache_file)
+        except (IOError, OSError) as e:
+            self.fail_json(msg='Could not write session cache {0}: {1}'.format(self.session_cache_file, e))
+
+    def _session_expired(self, response):
+        if response.status_code in SESSION_EXPIRED_STATUS_CODES:
+            return True
+        # An expired session gets redirected to the HTML login page instead of an error code
+        return response.content[:64].lstrip().startswith(b'<html>')
+
     def request(self, url_path, method='GET', data=None, files=None, headers=None, payload=None, status_codes=VALID_STATUS_CODES):
         """Generic HTTP method for viptela requests."""
 
@@ -151,63 +566,168 @@ class viptelaModule(object):
             data = json.dumps(payload)
             self.result['data'] = data
 
-        response = self.session.request(method, self.url, files=files, data=data)
+        try:
+            response = self._send(method, url_path, data=data, files=files)
+        except ConnectionError as e:
+            self.fail_json(msg=str(e))
 
         self.status_code = response.status_code
         self.status = requests.status_codes._codes[response.status_code][0]
-        decoded_response = {}
-        if self.status_code not in status_codes:
-            try:
-                decoded_response = response.json()
-            except JSONDecodeError:
-                pass
+        error_msg = self._decode_response(response, status_codes=status_codes)
+        if error_msg:
+            self.fail_json(msg=error_msg)
 
-            if 'error' in decoded_response:
-                error='Unknown'
-                details='Unknown'
-                if 'details' in decoded_response['error']:
-                    details = decoded_response['error']['details']
-                if 'message' in decoded_response['error']:
-                    error = decoded_response['error']['message']
-                self.fail_json(msg='{0}: {1}'.format(error, details))
+        return response
+
+    def request_many(self, request_list, status_codes=VALID_STATUS_CODES, fail_on_error=False):
+        """Send several requests concurrently over the shared session.
+
+        request_list holds (url_path, method, payload) tuples; a payload that is already a string is sent
+        as it is.  The responses are returned in the same order with response.json decoded and
+        response.error set to None, or to an error message when that request failed.  With fail_on_error,
+        all errors are reported together once the batch is done.
+        """
+        request_list = [tuple(item) + (None,) * (3 - len(item)) for item in request_list]
+        self.session.headers['Content-Type'] = 'application/json'
+
+        def send(item):
+            url_path, method, payload = item
+            if isinstance(payload, (str, type(u''))):
+                data = payload
+            else:
+                data = json.dumps(payload) if payload else None
+            try:
+                return self._send(method or 'GET', url_path, data=data, relogin=False)
+            except (ConnectionError, requests.exceptions.RequestException) as e:
+                response = ConnectionResponse(0, '')
+                response.error = str(e)
+                return response
+
+        responses = self._map_concurrent(send, request_list)
+
+        # Logging in again is not thread safe, so an expired cached session is refreshed once here and
+        # only the requests that bounced are sent again.
+        expired = [index for index, response in enumerate(responses)
+                   if self.session_cache_file and response.status_code and self._session_expired(response)]
+        if expired:
+            self.login()
+            for index, response in zip(expired, self._map_concurrent(send, [request_list[index] for index in expired])):
+                responses[index] = response
+
+        errors = []
+        for item, response in zip(request_list, responses):
+            if not getattr(response, 'error', None):
+                response.error = self._decode_response(response, status_codes=status_codes)
             else:
-                self.fail_json(msg=self.status)
+                response.json = {}
+            if response.error:
+                errors.append('{0} {1}: {2}'.format(item[1] or 'GET', item[0], response.error))
 
-        try:
-            response.json = response.json()
-        except JSONDecodeError:
-            response.json = {}
+        if errors and fail_on_error:
+            self.fail_json(msg='{0} of {1} requests failed'.format(len(errors), len(request_list)), errors=errors)
 
-        return response
+        return responses
+
+    def upload_files(self, url_path, paths, fields=None, progress=None, status_codes=VALID_STATUS_CODES):
+        """Upload files concurrently as streamed multipart/form-data bodies.
+
+        Each file is read in chunks as it is sent.  progress(path, sent, total) is called as the uploads
+        go on.  The responses are returned in the order of paths, like request_many() does.
+        """
+        def upload(path):
+            encoder = StreamingMultipartEncoder(path, fields=fields,
+                                                progress=(lambda sent, total: progress(path, sent, total)) if progress else None)
+            try:
+                return self._send('POST', url_path, data=encoder, headers={'Content-Type': encoder.content_type},
+                                  relogin=False)
+            except (ConnectionError, IOError, OSError, requests.exceptions.RequestException) as e:
+                response = ConnectionResponse(0, '')
+                response.error = str(e)
+                return response
+            finally:
+                encoder.close()
+
+        # Log in before the threads start so that they do not all log in at once
+        self._login_direct_session()
+        responses = self._map_concurrent(upload, paths)
+
+        expired = [index for index, response in enumerate(responses)
+                   if self.session_cache_file and response.status_code and self._session_expired(response)]
+        if expired:
+            self.login()
+            for index, response in zip(expired, self._map_concurrent(upload, [paths[index] for index in expired])):
+                responses[index] = response
+
+        for response in responses:
+            if not getattr(response, 'error', None):
+                response.error = self._decode_response(response, status_codes=status_codes)
+            else:
+                response.json = {}
+        return responses
+
+    def _map_concurrent(self, function, items):
+        """Apply function to every item with at most `concurrency` threads and return the results in order."""
+        items = list(items)
+        if len(items) <= 1 or self.concurrency == 1:
+            return [function(item) for item in items]
+        pool = ThreadPool(min(self.concurrency, len(items)))
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+            pool.join()
 
     def get_template_attachments(self, template_id, key='host-name'):
         response = self.request('/dataservice/template/device/config/attached/{0}'.format(template_id))
 
+        return self.parse_template_attachments(response.json, key=key)
+
+    @staticmethod
+    def parse_template_attachments(response_json, key='host-name'):
         attached_devices = []
-        if response.json:
-            device_list = response.json['data']
+        if response_json:
+            device_list = response_json['data']
             for device in device_list:
                 attached_devices.append(device[key])
 
         return attached_devices
 
+    def get_feature_template_ids(self):
+        """Return the feature template name -> templateId index, fetched once per run.
+
+        All name to ID lookups go through this cache; add_feature_template_id() keeps it current when
+        the module creates feature templates.
+        """
+        if self.feature_template_ids is None:
+            self.feature_template_ids = OrderedDict()
+            response = self.request('/dataservice/template/feature')
+            if response.json:
+                for template in response.json['data']:
+                    self.feature_template_ids[template['templateName']] = template['templateId']
+
+        return self.feature_template_ids
+
+    def add_feature_template_id(self, name, template_id):
+        if self.feature_template_ids is not None and template_id:
+            self.feature_template_ids[name] = template_id
+
     def generalTemplates_to_id(self, generalTemplates):
         converted_generalTemplates = []
-        feature_templates = self.get_feature_template_dict(factory_default=True)
+        feature_templates = self.get_feature_template_ids()
         for template in generalTemplates:
             if 'templateName' not in template:
                 self.result['generalTemplates'] = generalTemplates
                 self.fail_json(msg="Bad template")
             if template['templateName'] in feature_templates:
                 template_item = {
-                    'templateId': feature_templates[template['templateName']]['templateId'],
+                    'templateId': feature_templates[template['templateName']],
                     'templateType': template['templateType']}
                 if 'subTemplates' in template:
                     subTemplates = []
                     for sub_template in template['subTemplates']:
                         if sub_template['templateName'] in feature_templates:
                             subTemplates.append(
-                                {'templateId': feature_templates[sub_template['templateName']]['templateId'],
+                                {'templateId': feature_templates[sub_template['templateName']],
                                  'templateType': sub_template['templateType']})
                         else:
                             self.fail_json(msg="There is no existing feature template named {0}".format(
@@ -220,12 +740,22 @@ class viptelaModule(object):
 
         return converted_generalTemplates
 
+    def get_policy_list_ids(self):
+        """Return the (list type, list name) -> listId index of all policy lists, fetched once per run."""
+        if self.policy_list_ids is None:
+            self.policy_list_ids = {}
+            for policy_list in self.get_policy_list_list('all'):
+                self.policy_list_ids[(policy_list['type'].lower(), policy_list['name'])] = policy_list['listId']
+
+        return self.policy_list_ids
+
     def convert_sequences_to_id(self, sequence_list):
+        policy_list_ids = self.get_policy_list_ids()
         for sequence in sequence_list:
             for entry in sequence['match']['entries']:
-                policy_list_dict = self.get_policy_list_dict(entry['listType'])
-                if entry['listName'] in policy_list_dict:
-                    entry['ref'] = policy_list_dict[entry['listName']]['listId']
+                list_key = (entry['listType'].lower(), entry['listName'])
+                if list_key in policy_list_ids:
+                    entry['ref'] = policy_list_ids[list_key]
                     entry.pop('listName')
                     entry.pop('listType')
                 else:
@@ -240,47 +770,86 @@ class viptelaModule(object):
         except:
             return {}
 
-    def get_device_template_list(self, factory_default=False):
+    def get_device_template_list(self, factory_default=False, fields=None):
+        """Return the device templates, optionally projected to `fields`.
+
+        The template object, attachments and input are fetched concurrently, and only when `fields` asks
+        for something that the /template/device summary does not already contain.
+        """
         response = self.request('/dataservice/template/device')
 
         return_list = []
         if response.json:
+            device_list = []
+            for device in response.json['data']:
+                if not factory_default and device.get('factoryDefault'):
+                    continue
+                device_list.append(device)
 
-            device_body = response.json
-            feature_template_dict = self.get_feature_template_dict(factory_default=True, key_name='templateId')
+            if fields is None:
+                need_object = need_attachments = need_input = True
+            else:
+                need_attachments = 'attached_devices' in fields
+                need_input = 'input' in fields
+                extra_fields = set(fields) - set(['templateId', 'attached_devices', 'input'])
+                need_object = any(extra_fields - set(device) for device in device_list)
 
-            for device in device_body['data']:
-                object_response = self.request('/dataservice/template/device/object/{0}'.format(device['templateId']))
-                if object_response.json:
-                    object = object_response.json
-                    if not factory_default and object['factoryDefault']:
+            request_list = []
+            for device in device_list:
+                if need_object:
+                    request_list.append(('/dataservice/template/device/object/{0}'.format(device['templateId']), 'GET', None))
+                if need_attachments:
+                    request_list.append(('/dataservice/template/device/config/attached/{0}'.format(device['templateId']), 'GET', None))
+                if need_input:
+                    request_list.append(('/dataservice/template/device/config/input', 'POST',
+                                         self.template_input_payload(device['templateId'])))
+            responses = self.request_many(request_list, fail_on_error=True)
+            # Each template has the same number of responses, in the order they were requested above
+            per_template = [need_object, need_attachments, need_input].count(True)
+
+            feature_template_names = {}
+            if need_object:
+                feature_template_names = dict((template_id, name) for name, template_id in self.get_feature_template_ids().items())
+
+            for index, device in enumerate(device_list):
+                template_responses = iter(responses[index * per_template:(index + 1) * per_template])
+                object = device
+                if need_object:
+                    object = next(template_responses).json
+                    if not object:
                         continue
 
                     if 'generalTemplates' in object:
                         generalTemplates = []
                         for old_template in object.pop('generalTemplates'):
                             new_template = {
-                                'templateName': feature_template_dict[old_template['templateId']]['templateName'],
+                                'templateName': feature_template_names[old_template['templateId']],
                                 'templateType': old_template['templateType']}
                             if 'subTemplates' in old_template:
                                 subTemplates = []
                                 for sub_template in old_template['subTemplates']:
-                                    subTemplates.append({'templateName':feature_template_dict[sub_template['templateId']]['templateName'], 'templateType':sub_template['templateType']})
+                                    subTemplates.append({'templateName':feature_template_names[sub_template['templateId']], 'templateType':sub_template['templateType']})
                                 new_template['subTemplates'] = subTemplates
 
                             generalTemplates.append(new_template)
                         object['generalTemplates'] = generalTemplates
 
-                    object['templateId'] = device['templateId']
-                    object['attached_devices'] = self.get_template_attachments(device['templateId'])
-                    object['input'] = self.get_template_input(device['templateId'])
+                object['templateId'] = device['templateId']
+                if need_attachments:
+                    object['attached_devices'] = self.parse_template_attachments(next(template_responses).json)
+                if need_input:
+                    object['input'] = self._parse_template_input(next(template_responses).json)
 
-                    return_list.append(object)
+                if fields is not None:
+                    object = dict((key, value) for key, value in object.items() if key in fields or key == 'templateId')
+                return_list.append(object)
 
         return return_list
 
-    def get_device_template_dict(self, factory_default=False, key_name='templateName', remove_key=True):
-        device_template_list = self.get_device_template_list(factory_default=factory_default)
+    def get_device_template_dict(self, factory_default=False, key_name='templateName', remove_key=True, fields=None):
+        if fields is not None and key_name not in fields:
+            fields = list(fields) + [key_name]
+        device_template_list = self.get_device_template_list(factory_default=factory_default, fields=fields)
 
         return self.list_to_dict(device_template_list, key_name, remove_key)
 
@@ -334,6 +903,42 @@ class viptelaModule(object):
 
         return response.json['data']
 
+    def get_policy_bundle(self):
+        """Return all policy lists, policy definitions (in full) and central policies with their original IDs."""
+        definition_types = list(OrderedDict.fromkeys(self.POLICY_DEFINITION_TYPES))
+        responses = self.request_many([('/dataservice/template/policy/list', 'GET', None),
+                                       ('/dataservice/template/policy/vsmart', 'GET', None)] +
+                                      [('/dataservice/template/policy/definition/{0}'.format(type), 'GET', None)
+                                       for type in definition_types],
+                                      status_codes=[200, 404], fail_on_error=True)
+
+        policy_lists = responses[0].json.get('data', [])
+        central_policies = responses[1].json.get('data', [])
+        for policy in central_policies:
+            try:
+                policy['policyDefinition'] = json.loads(policy['policyDefinition'])
+            except (TypeError, ValueError):
+                # CLI policies keep their configuration text
+                pass
+
+        # The definition lists only hold summaries, so fetch the details of all definitions in one batch
+        summaries = [(type, definition) for type, response in zip(definition_types, responses[2:])
+                     for definition in response.json.get('data', [])]
+        responses = self.request_many([('/dataservice/template/policy/definition/{0}/{1}'.format(type, definition['definitionId']), 'GET', None)
+                                       for type, definition in summaries], fail_on_error=True)
+        policy_definitions = []
+        for (type, summary), response in zip(summaries, responses):
+            definition = response.json
+            definition['definitionId'] = summary['definitionId']
+            definition.setdefault('type', type)
+            policy_definitions.append(definition)
+
+        return {
+            'policy_lists': policy_lists,
+            'policy_definitions': policy_definitions,
+            'central_policies': central_policies,
+        }
+
     def get_vmanage_org(self):
         response = self.request('/dataservice/settings/configuration/organization')
         try:
@@ -394,6 +999,28 @@ class viptelaModule(object):
             self.fail_json(msg='Did not get action ID after attaching device to template.')
         return response.json['id']
 
+    def get_policy_definition_ids(self, types):
+        """Return the (definition type, name) -> definitionId index covering `types`.
+
+        Each type is fetched once per run; the types not fetched yet are fetched concurrently.
+        """
+        if self.policy_definition_ids is None:
+            self.policy_definition_ids = {}
+            self.policy_definition_types = set()
+
+        missing_types = []
+        for type in types:
+            if type not in self.policy_definition_types and type not in missing_types:
+                missing_types.append(type)
+        responses = self.request_many([('/dataservice/template/policy/definition/{0}'.format(type), 'GET', None)
+                                       for type in missing_types], fail_on_error=True)
+        for type, response in zip(missing_types, responses):
+            for definition in response.json.get('data', []):
+                self.policy_definition_ids[(type, definition['name'])] = definition['definitionId']
+            self.policy_definition_types.add(type)
+
+        return self.policy_definition_ids
+
     def get_policy_definition_dict(self, type, key_name='name', remove_key=False):
 
         policy_definition_list = self.get_policy_definition_list(type)
@@ -406,15 +1033,22 @@ class viptelaModule(object):
             central_policy_list = response.json['data']
             for policy in central_policy_list:
                 policy['policyDefinition'] = json.loads(policy['policyDefinition'])
-                for item in policy['policyDefinition']['assembly']:
-                    policy_definition = self.get_policy_definition(item['type'], item['definitionId'])
-                    item['definitionName'] = policy_definition['name']
-                    for entry in item['entries']:
-                        for key, list in entry.items():
-                            if key in POLICY_LIST_DICT:
-                                for index, list_id in enumerate(list):
-                                    policy_list = self.get_policy_list(POLICY_LIST_DICT[key], list_id)
-                                    list[index] = policy_list['name']
+
+            # Build the ID -> name indexes from bulk fetches so that decoding is just dictionary lookups
+            definition_types = [item['type'] for policy in central_policy_list
+                                for item in policy['policyDefinition'].get('assembly', [])]
+            definition_names = dict((definition_id, name) for (definition_type, name), definition_id
+                                    in self.get_policy_definition_ids(definition_types).items())
+            list_names = dict((list_id, name) for (list_type, name), list_id in self.get_policy_list_ids().items())
+
+            for policy in central_policy_list:
+                for item in policy['policyDefinition'].get('assembly', []):
+                    item['definitionName'] = definition_names[item['definitionId']]
+                    for entry in item.get('entries', []):
+                        for key, list_ids in entry.items():
+                            if POLICY_LIST_KEY_REGEX.match(key) and isinstance(list_ids, list):
+                                for index, list_id in enumerate(list_ids):
+                                    list_ids[index] = list_names[list_id]
             #     if 'policyDefinition' in policy:
             #         for old_template in policy.pop('policyDefinition'):
             #
@@ -452,34 +1086,44 @@ class viptelaModule(object):
             return {}
 
     def get_device_by_uuid(self, uuid, type='vedges'):
-        response = self.request('/dataservice/system/device/{0}?uuid={1}'.format(type, uuid))
-
-        if response.json:
-            try:
-                return response.json['data'][0]
-            except:
-                return response.json['data']
-        else:
-            return {}
+        return self.find_device(uuid, key='uuid', type=type)
 
     def get_device_by_device_ip(self, device_ip, type='vedges'):
-        response = self.request('/dataservice/system/device/{0}?deviceIP={1}'.format(type, device_ip))
-
-        if response.json:
-            try:
-                return response.json['data'][0]
-            except:
-                return response.json['data']
-        else:
-            return {}
+        return self.find_device(device_ip, key='deviceIP', type=type)
 
     def get_device_by_name(self, name, type='vedges'):
-        device_dict = self.get_device_dict(type)
+        return self.find_device(name, key='host-name', type=type)
 
-        try:
-            return device_dict[name]
-        except:
-            return {}
+    def find_device(self, value, key='host-name', type='vedges'):
+        """Return the device of the given type whose `key` (one of DEVICE_INDEX_KEYS) is value, or {}.
+
+        vManage filters on the uuid and deviceIP itself, and a host-name or system-ip is first resolved
+        to a uuid through the device status.  Anything else, or a device that has no status yet, is
+        looked up in the index of the whole inventory, which is fetched at most once per run.
+        """
+        if type not in self.device_index and key in DEVICE_STATUS_QUERY_KEYS:
+            device_status = self.get_device_status(value, key=key)
+            if device_status.get('uuid'):
+                key, value = 'uuid', device_status['uuid']
+
+        if type in self.device_index or key not in DEVICE_QUERY_KEYS:
+            return self.get_device_index(type).get(key, {}).get(value, {})
+
+        response = self.request('/dataservice/system/device/{0}?{1}={2}'.format(type, key, value))
+        if response.json and response.json.get('data'):
+            return response.json['data'][0]
+        return {}
+
+    def get_device_index(self, type='vedges'):
+        """Return the key -> value -> device index of the inventory of a device type, fetched once per run."""
+        if type not in self.device_index:
+            index = dict((key, {}) for key in DEVICE_INDEX_KEYS)
+            for device in self.get_device_list(type):
+                for key in DEVICE_INDEX_KEYS:
+                    if device.get(key) is not None:
+                        index[key].setdefault(device[key], device)
+            self.device_index[type] = index
+        return self.device_index[type]
 
     def get_device_list(self, type, key_name='host-name', remove_key=True):
         response = self.request('/dataservice/system/device/{0}'.format(type))
@@ -505,7 +1149,7 @@ class viptelaModule(object):
 
     def get_device_status_dict(self, key_name='host-name', remove_key=False):
 
-        device_list = self.get_device_list()
+        device_list = self.get_device_status_list()
 
         return self.list_to_dict(device_list, key_name=key_name, remove_key=remove_key)
 
@@ -576,8 +1220,27 @@ class viptelaModule(object):
     def generate_bootstrap(self, uuid):
         response = self.request('/dataservice/system/device/bootstrap/device/{0}?configtype=cloudinit'.format(uuid))
 
+        return self.parse_bootstrap(response.json, uuid)
+
+    def generate_bootstraps(self, uuids):
+        """Generate the cloud-init bootstrap of several devices concurrently.
+
+        Returns a list in the order of uuids holding what generate_bootstrap() returns for each device,
+        with an 'error' entry added.
+        """
+        responses = self.request_many([('/dataservice/system/device/bootstrap/device/{0}?configtype=cloudinit'.format(uuid), 'GET', None)
+                                       for uuid in uuids])
+        bootstraps = []
+        for uuid, response in zip(uuids, responses):
+            bootstrap = self.parse_bootstrap(response.json, uuid) or {'bootstrapConfig': None, 'otp': None, 'uuid': uuid}
+            bootstrap['error'] = response.error or (None if bootstrap['bootstrapConfig'] else 'No bootstrap config returned')
+            bootstraps.append(bootstrap)
+        return bootstraps
+
+    @staticmethod
+    def parse_bootstrap(response_json, uuid):
         try:
-            bootstrap_config = response.json['bootstrapConfig']
+            bootstrap_config = response_json['bootstrapConfig']
         except:
             return None
 
@@ -595,256 +1258,108 @@ class viptelaModule(object):
         }    
         return return_dict
 
-    def get_template_input(self, template_id):
-        payload = {
-            "deviceIds": [],
+    @staticmethod
+    def template_input_payload(template_id, device_ids=None):
+        return {
+            "deviceIds": device_ids or [],
             "isEdited": False,
             "isMasterEdited": False,
             "templateId": template_id
         }
-        return_dict = {
-            "columns": [],
-        }
-        response = self.request('/dataservice/template/device/config/input', method='POST', payload=payload)
-
-        if response.json:
-            if 'header' in response.json and 'columns' in response.json['header']:
-                column_list = response.json['header']['columns']
 
-                regex = re.compile(r'\((?P<variable>[^(]+)\)')
+    def get_template_input(self, template_id):
+        return {'columns': self.get_template_schema(template_id)['columns']}
 
-                for column in column_list:
-                    if column['editable']:
-                        match = regex.search(column['title'])
-                        if match:
-                            variable = match.groups('variable')[0]
-                        else:
-                            variable = None
+    def get_template_variables(self, template_id):
+        return self.get_template_schema(template_id)['variables']
 
-                        entry = {'title': column['title'],
-                                 'property': column['property'],
-                                 'variable': variable}
-                        return_dict['columns'].append(entry)
+    def get_template_optional_variables(self, template_id):
+        return self.get_template_schema(template_id)['optional_variables']
 
-        return return_dict
+    def get_template_schema(self, template_id):
+        """Fetch the input header of a device template once and parse everything needed to attach it.
 
-    def get_template_variables(self, template_id):
-        payload = {
-            "deviceIds": [],
-            "isEdited": False,
-            "isMasterEdited": False,
-            "templateId": template_id
-        }
-        return_dict = {}
+        Returns the editable columns, the variable -> property map and its optional and mandatory subsets.
+        """
+        payload = self.template_input_payload(template_id)
         response = self.request('/dataservice/template/device/config/input', method='POST', payload=payload)
 
-        if response.json:
-            if 'header' in response.json and 'columns' in response.json['header']:
-                column_list = response.json['header']['columns']
+        return self.parse_template_schema(response.json)
 
-                regex = re.compile(r'\((?P<variable>[^(]+)\)')
+    @staticmethod
+    def _parse_template_input(response_json):
+        return {'columns': viptelaModule.parse_template_schema(response_json)['columns']}
 
-                for column in column_list:
-                    if column['editable']:
-                        #match = regex.search(column['title'])
-                        match = regex.findall(column['title'])
-                        if match:
-                            #variable = match.groups('variable')[0]
-                            variable = match[-1]
-                            return_dict[variable] = column['property']
+    @staticmethod
+    def parse_template_schema(response_json):
+        schema = {
+            'columns': [],
+            'variables': {},
+            'optional_variables': {},
+            'mandatory_variables': {},
+        }
+        if not response_json or 'header' not in response_json or 'columns' not in response_json['header']:
+            return schema
 
-        return return_dict
+        column_list = response_json['header']['columns']
+        for column in column_list:
+            if column['editable']:
+                match = TEMPLATE_VARIABLE_REGEX.findall(column['title'])
+                schema['columns'].append({'title': column['title'],
+                                          'property': column['property'],
+                                          'variable': match[0] if match else None})
+                if match:
+                    schema['variables'][match[-1]] = column['property']
 
+        schema['optional_variables'] = viptelaModule._get_optional_variables(column_list)
+        schema['mandatory_variables'] = dict((variable, property) for variable, property in schema['variables'].items()
+                                             if variable not in schema['optional_variables'])
 
-    def get_template_optional_variables(self, template_id):
-        payload = {
-            "deviceIds": [],
-            "isEdited": False,
-            "isMasterEdited": False,
-            "templateId": template_id
-        }
-        return_dict = {}
-        response = self.request('/dataservice/template/device/config/input', method='POST', payload=payload)
+        return schema
 
-        if response.json:
-            if 'header' in response.json and 'columns' in response.json['header']:
-                column_list = response.json['header']['columns']
-
-                regex = re.compile(r'\((?P<variable>[^(]+)\)')
-
-                # The following can be removed once the API will mark as optional
-                # the nexthop value of a static route that has been marked as optional
-                regexYangStaticR = re.compile(r'.*/vpn-instance/ip/route/.*/prefix')
-                regex_yang_nexthop = re.compile(r'.*/vpn-instance/ip/route/(?P<staticR>.*)/next-hop/.*/address')
-                optionalStaticRoutesList = []
-                # Until here
-
-                # The following can be removed once the API will mark as optional
-                # all the vrrp attributes once the vrrp grp-id has been marked optional
-                regexYangVRRPgrpID = re.compile(r'.*/vrrp/.*/grp-id')
-                regexYangVRRPpriority = re.compile(r'.*/vrrp/(?P<VVRPgrp>.*)/priority')
-                regexYangVRRPtimer = re.compile(r'.*/vrrp/(?P<VVRPgrp>.*)/timer')
-                regexYangVRRPtrackPrefix = re.compile(r'.*/vrrp/(?P<VVRPgrp>.*)/track-prefix-list')
-                regexYangVRRPtrackOMP = re.compile(r'.*/vrrp/(?P<VVRPgrp>.*)/track-omp')
-                regexYangVRRPipAddress = re.compile(r'.*/vrrp/(?P<VVRPgrp>.*)/ipv4/address')
-                optionalVRRPvariales = []
-                # Until here
-
-                # The following can be removed once the API will mark as optional
-                # all the logging attributes once the logging has been marked optional
-                regexYangLoggingServerName = re.compile(r'///logging/server/.*/name')
-                regexYangLoggingSourceInt = re.compile(r'///logging/server/(?P<LoggServer>.*)/source-interface')
-                regexYangLoggingVPN  = re.compile(r'///logging/server/(?P<LoggServer>.*)/vpn')
-                regexYangLoggingPriority = re.compile(r'///logging/server/(?P<LoggServer>.*)/priority')
-                optionalLoggingVariales = []
-                # Until here
-
-                for column in column_list:
-
-                    # The following can be removed once the API will mark as optional
-                    # the nexthop value of a static route that has been marked as optional
-
-                    # Based on the regular expression above we match
-                    # static routes and next-hop variables based on the YANG variable
-                    # a static route looks like this /1/vpn-instance/ip/route/<COMMON_NAME_OF_THE_ROUTE>/prefix
-                    # a next-hop looks like this /1/vpn-instance/ip/route/<COMMON_NAME_OF_THE_ROUTE>/next-hop/<COMMON_NAME_OF_THE_NH>/address
-
-                    # If we find a static route and this is optional we
-                    # store its common name into an array
-                    # we don't add this parameter to the return list now
-                    # since it will be added later
-                    isStaticR = regexYangStaticR.match(column['property'])
-                    if isStaticR and column['optional']:
-                        match = regex.findall(column['title'])
-                        if match:
-                            variable = match[-1]
-                            optionalStaticRoutesList.append(variable)
-
-
-                    # If we find a next-hop we extrapolate the common name
-                    # of the static route. If we have already found that
-                    # common name and we know it is optional we will add
-                    # this next-hop paramter to the return list since it
-                    # will be optional as well
-                    
-                    # ALL OF THIS IS BASED ON THE ASSUMPTION THAT STATIC ROUTES
-                    # ARE LISTED BEFORE NEXT-HOP VALUES
-                    nextHopStaticR = regex_yang_nexthop.findall(column['property'])
-                    if nextHopStaticR:
-                        if nextHopStaticR[0] in optionalStaticRoutesList:
-                            match = regex.findall(column['title'])
-                            if match:
-                                variable = match[-1]
-                                return_dict[variable] = column['property']
-
-                    # Until here
-
-                    # The following can be removed once the API will mark as optional
-                    # the attributes for vrrp as optional if the whole vrrp has been
-                    # marked as optional
-
-                    # Based on the regular expression above we match
-                    # vrrp atributes based on the YANG variable
-
-                    # If we find a VRRP grp ID and this is optional we
-                    # store its common name into an array
-                    # we don't add this parameter to the return list now
-                    # since it will be added later
-                    isVRRP = regexYangVRRPgrpID.match(column['property'])
-                    if isVRRP and column['optional']:
-                        match = regex.findall(column['title'])
-                        if match:
-                            variable = match[-1]
-                            optionalVRRPvariales.append(variable)
-
-
-                    # If we find a any vrrp attribute we extrapolate the common name
-                    # If we have already found that
-                    # common name and we know it is optional we will add
-                    # this paramter to the return list since it
-                    # will be optional as well
-
-                    # ALL OF THIS IS BASED ON THE ASSUMPTION THAT VRRP GRP-ID is
-                    # LISTED BEFORE ALL THE OTHER ATTRIBUTES
-                    VRRPpriority = regexYangVRRPpriority.findall(column['property'])
-                    VRRPtimer = regexYangVRRPtimer.findall(column['property'])
-                    VRRPtrackPrefix = regexYangVRRPtrackPrefix.findall(column['property'])
-                    VRRPipAddress = regexYangVRRPipAddress.findall(column['property'])
-                    VRRPtrackOMP = regexYangVRRPtrackOMP.findall(column['property'])
-                    if VRRPpriority:
-                        if VRRPpriority[0] in optionalVRRPvariales:
-                            match = regex.findall(column['title'])
-                            if match:
-                                variable = match[-1]
-                                return_dict[variable] = column['property']
-                    elif VRRPtimer:
-                        if VRRPtimer[0] in optionalVRRPvariales:
-                            match = regex.findall(column['title'])
-                            if match:
-                                variable = match[-1]
-                                return_dict[variable] = column['property']
-                    elif VRRPtrackPrefix:
-                        if VRRPtrackPrefix[0] in optionalVRRPvariales:
-                            match = regex.findall(column['title'])
-                            if match:
-                                variable = match[-1]
-                                return_dict[variable] = column['property']
-                    elif VRRPipAddress:
-                        if VRRPipAddress[0] in optionalVRRPvariales:
-                            match = regex.findall(column['title'])
-                            if match:
-                                variable = match[-1]
-                                return_dict[variable] = column['property']
-                    elif VRRPtrackOMP:
-                        if VRRPtrackOMP[0] in optionalVRRPvariales:
-                            match = regex.findall(column['title'])
-                            if match:
-                                variable = match[-1]
-                                return_dict[variable] = column['property']                    
-                    # Until here
-
-                    # Same logic for logging optional variables
-                    isLogging = regexYangLoggingServerName.match(column['property'])
-                    if isLogging and column['optional']:
-                        match = regex.findall(column['title'])
-                        if match:
-                            variable = match[-1]
-                            optionalLoggingVariales.append(variable)
-
-                    LoggingSourceInt = regexYangLoggingSourceInt.findall(column['property'])
-                    LoggingVPN = regexYangLoggingVPN.findall(column['property'])
-                    LoggingPriority = regexYangLoggingPriority.findall(column['property'])
-
-                    if LoggingSourceInt:
-                        if LoggingSourceInt[0] in optionalLoggingVariales:
-                            match = regex.findall(column['title'])
-                            if match:
-                                variable = match[-1]
-                                return_dict[variable] = column['property']
-                    elif LoggingVPN:
-                        if LoggingVPN[0] in optionalLoggingVariales:
-                            match = regex.findall(column['title'])
-                            if match:
-                                variable = match[-1]
-                                return_dict[variable] = column['property']
-                    elif LoggingPriority:
-                        if LoggingPriority[0] in optionalLoggingVariales:
-                            match = regex.findall(column['title'])
-                            if match:
-                                variable = match[-1]
-                                return_dict[variable] = column['property']
-
-                    # Until here
-
-                    if column['editable'] and column['optional']:
-                        match = regex.findall(column['title'])
-                        if match:
-                            variable = match[-1]
-                            return_dict[variable] = column['property']
+    @staticmethod
+    def _get_column_variable(column):
+        match = TEMPLATE_VARIABLE_REGEX.findall(column['title'])
+        if match:
+            return match[-1]
+        return None
 
+    @staticmethod
+    def _get_optional_variables(column_list):
+        # First pass: index the instance paths made optional by a parent column, whatever the column order
+        optional_instances = {}
+        for column in column_list:
+            if not column['optional']:
+                continue
+            for rule in OPTIONAL_PARENT_RULES:
+                match = rule['parent'].match(column['property'])
+                if match:
+                    optional_instances.setdefault(match.group('instance'), []).append(rule['children'])
+
+        # Second pass: a column is optional if vManage says so, or if one of its parent paths is an
+        # optional instance whose rule covers this attribute.
+        return_dict = {}
+        for column in column_list:
+            variable = viptelaModule._get_column_variable(column)
+            if not variable:
+                continue
+            if column['editable'] and column['optional']:
+                return_dict[variable] = column['property']
+            elif optional_instances and viptelaModule._in_optional_instance(column['property'], optional_instances):
+                return_dict[variable] = column['property']
 
         return return_dict
 
+    @staticmethod
+    def _in_optional_instance(property, optional_instances):
+        index = property.find('/', 1)
+        while index != -1:
+            for children in optional_instances.get(property[:index], []):
+                if children.match(property[index:]):
+                    return True
+            index = property.find('/', index + 1)
+        return False
+
     def get_software_images_list(self):
         #TODO undertand the difference with the URL: /dataservice/device/action/software/images used in devnetsandbox
         response = self.request('/dataservice/device/action/software', method='GET')
@@ -864,7 +1379,21 @@ class viptelaModule(object):
 
     def software_install(self,devices,deviceType,data,reboot):
 
-        payload= {
+        payload = self.software_install_payload(devices, deviceType, data, reboot)
+
+        response = self.request('/dataservice/device/action/install', method='POST', payload=payload)
+
+        if response.json and 'id' in response.json:
+            self.waitfor_action_completion(response.json['id'])
+        else:
+            self.fail_json(
+                msg='Did not get action ID after installing software.')
+
+        return response.json['id']
+
+    @staticmethod
+    def software_install_payload(devices, deviceType, data, reboot):
+        return {
             "action":"install",
             "input":{
                 "vEdgeVPN":0,
@@ -878,23 +1407,9 @@ class viptelaModule(object):
             "deviceType": deviceType
         }
 
-        response = self.request('/dataservice/device/action/install', method='POST', payload=payload)
-
-        if response.json and 'id' in response.json:
-            self.waitfor_action_completion(response.json['id'])
-        else:
-            self.fail_json(
-                msg='Did not get action ID after installing software.')
-
-        return response.json['id']
-
     def set_default_partition(self,devices,deviceType):
 
-        payload= {
-            "action":"defaultpartition",
-            "devices": devices,
-            "deviceType": deviceType
-        }
+        payload = self.set_default_partition_payload(devices, deviceType)
 
         response = self.request('/dataservice/device/action/defaultpartition', method='POST', payload=payload)
 
@@ -906,6 +1421,14 @@ class viptelaModule(object):
 
         return response.json['id']
 
+    @staticmethod
+    def set_default_partition_payload(devices, deviceType):
+        return {
+            "action":"defaultpartition",
+            "devices": devices,
+            "deviceType": deviceType
+        }
+
     def push_certificates(self):
         response = self.request('/dataservice/certificate/vedge/list?action=push', method='POST')
         if response.json and 'id' in response.json:
@@ -915,67 +1438,209 @@ class viptelaModule(object):
         return response.json['id']
 
     def reattach_device_template(self, template_id, process_id=None):
-        device_list = self.get_template_attachments(template_id, key='uuid')
+        result = self.reattach_device_templates([template_id], process_id=process_id)
+        return result[template_id]['action_id'] if template_id in result else None
+
+    def reattach_device_templates(self, template_ids, process_id=None, batch_size=None, wait=True):
+        """Reattach the devices of several templates and wait for all of the resulting actions together.
+
+        The attachments and the device input of every template are fetched concurrently (at most
+        `concurrency` requests at a time), then the templates are attached `batch_size` templates per
+        attachfeature request (all in one request by default).  Returns an OrderedDict of template ID ->
+        dict with the action ID and, when waiting, the status of each of its devices.
+        """
+        template_ids = list(OrderedDict.fromkeys(template_ids))
+        responses = self.request_many([('/dataservice/template/device/config/attached/{0}'.format(template_id), 'GET', None)
+                                       for template_id in template_ids], fail_on_error=True)
+        attachments = OrderedDict()
+        for template_id, response in zip(template_ids, responses):
+            device_list = self.parse_template_attachments(response.json, key='uuid')
+            if device_list:
+                attachments[template_id] = device_list
+
         # First, we need to get the input to feed to the re-attach
-        payload = {
+        responses = self.request_many([('/dataservice/template/device/config/input/', 'POST', {
             "templateId": template_id,
             "deviceIds": device_list,
             "isEdited": "true",
             "isMasterEdited": "false"
-        }
-        response = self.request('/dataservice/template/device/config/input/', method='POST', payload=payload)
-        # Then we feed that to the attach
-        if response.json and 'data' in response.json:
-            payload = {
-                "deviceTemplateList":
-                    [
-                        {
-                            "templateId": template_id,
-                            "device": response.json['data'],
-                            "isEdited": "true"
-                        }
-                    ]
-            }
-            response = self.request('/dataservice/template/device/config/attachfeature', method='POST', payload=payload)
-            if response.json and 'id' in response.json:
-                self.waitfor_action_completion(response.json['id'])
-            else:
-                self.fail_json(
-                    msg='Did not get action ID after attaching device to template.')
+        }) for template_id, device_list in attachments.items()], fail_on_error=True)
+        device_template_list = []
+        for template_id, response in zip(attachments, responses):
+            if not response.json or 'data' not in response.json:
+                self.fail_json(msg="Could not retrieve input for template {0}".format(template_id))
+            device_template_list.append({
+                "templateId": template_id,
+                "device": response.json['data'],
+                "isEdited": "true"
+            })
 
-            # if process_id:
-            #    self.request('/dataservice/template/lock/{0}'.format(process_id), method='DELETE')
+        # Then we feed that to the attach
+        batch_size = batch_size or len(device_template_list) or 1
+        batches = [device_template_list[index:index + batch_size]
+                   for index in range(0, len(device_template_list), batch_size)]
+        responses = self.request_many([('/dataservice/template/device/config/attachfeature', 'POST', {
+            "deviceTemplateList": batch
+        }) for batch in batches], fail_on_error=True)
+
+        result = OrderedDict()
+        for batch, response in zip(batches, responses):
+            if not response.json or 'id' not in response.json:
+                self.fail_json(msg='Did not get action ID after attaching device to template.')
+            for device_template in batch:
+                result[device_template['templateId']] = {'action_id': response.json['id'], 'devices': []}
+
+        # if process_id:
+        #    self.request('/dataservice/template/lock/{0}'.format(process_id), method='DELETE')
+
+        if wait and result:
+            action_ids = list(OrderedDict.fromkeys(template['action_id'] for template in result.values()))
+            self.waitfor_actions_completion(action_ids)
+            device_templates = dict((device_id, template_id) for template_id, device_list in attachments.items()
+                                    for device_id in device_list)
+            for summary in self.result['actions'].values():
+                for device in summary['devices']:
+                    template_id = device_templates.get(device['uuid'])
+                    if template_id in result:
+                        result[template_id]['devices'].append(device)
+
+        return result
+
+    def waitfor_action_completion(self, action_id, timeout=None, poll_interval=None, max_poll_interval=None):
+        """Poll an action until it is done, backing off exponentially (with jitter) between polls."""
+        action = self.poll_actions([action_id], timeout=timeout, poll_interval=poll_interval,
+                                   max_poll_interval=max_poll_interval)[action_id]
+        if action['error']:
+            self.fail_json(msg="Unable to get action status: {0}".format(action['error']))
 
-        else:
-            self.fail_json(msg="Could not retrieve input for template {0}".format(template_id))
-        return response.json['id']
+        # self.result['action_response'] = response.json
+        self._set_action_result(action_id, action['response'].json)
+        if not action['complete']:
+            self.fail_json(msg="Timed out after {0} seconds waiting for action {1}".format(
+                self._get_wait_option('wait_timeout', timeout), action_id))
+        if self.result['action_status'] == 'failure' or self.result['action_failed_devices']:
+            self.fail_json(msg="Action failed")
+        return action['response']
+
+    def waitfor_actions_completion(self, action_ids, timeout=None, poll_interval=None, max_poll_interval=None):
+        """Wait for several actions at once and report each of them in result['actions'].
+
+        Fails once all actions are finished (or the timeout passed) if any of them failed or did not finish.
+        """
+        actions = self.poll_actions(action_ids, timeout=timeout, poll_interval=poll_interval,
+                                    max_poll_interval=max_poll_interval)
+        self.result['actions'] = OrderedDict((action_id, self.get_action_summary(action))
+                                             for action_id, action in actions.items())
+        self.result['completed_actions'] = [action_id for action_id, action in sorted(
+            actions.items(), key=lambda item: item[1]['elapsed']) if action['complete']]
+
+        failed = [action_id for action_id, summary in self.result['actions'].items()
+                  if summary['error'] or summary['failed_devices']]
+        pending = [action_id for action_id, summary in self.result['actions'].items()
+                   if not summary['complete'] and not summary['error']]
+        if failed or pending:
+            self.fail_json(msg="{0} action(s) failed, {1} did not finish".format(len(failed), len(pending)),
+                           failed_actions=failed, pending_actions=pending)
+        return actions
+
+    def poll_actions(self, action_ids, timeout=None, poll_interval=None, max_poll_interval=None):
+        """Poll the status of all pending actions together until every one of them is done or the timeout passes.
+
+        Returns an OrderedDict of action ID -> dict with the last status response, whether it completed,
+        the seconds it took and any error getting its status.
+        """
+        timeout = self._get_wait_option('wait_timeout', timeout)
+        interval = max(0.1, self._get_wait_option('poll_interval', poll_interval))
+        max_interval = max(interval, self._get_wait_option('max_poll_interval', max_poll_interval))
+        start = time.time()
+        deadline = start + timeout
+
+        actions = OrderedDict((action_id, {'response': None, 'complete': False, 'elapsed': None, 'error': None})
+                              for action_id in action_ids)
+        pending = list(actions)
+        while pending:
+            responses = self.request_many([('/dataservice/device/action/status/{0}'.format(action_id), 'GET', None)
+                                           for action_id in pending])
+            still_pending = []
+            for action_id, response in zip(pending, responses):
+                action = actions[action_id]
+                if response.error or not response.json:
+                    action['error'] = response.error or 'No response'
+                    action['elapsed'] = time.time() - start
+                    continue
+                action['response'] = response
+                if self._action_complete(response.json):
+                    action['complete'] = True
+                    action['elapsed'] = time.time() - start
+                else:
+                    still_pending.append(action_id)
+            pending = still_pending
+            if not pending:
+                break
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, random.uniform(interval / 2.0, interval)))
+            interval = min(interval * 2, max_interval)
+
+        return actions
+
+    def get_action_summary(self, action):
+        summary = {
+            'complete': action['complete'],
+            'elapsed': action['elapsed'],
+            'error': action['error'],
+            'status': None,
+            'devices': [],
+            'failed_devices': [],
+        }
+        if action['response'] is not None:
+            devices = action['response'].json.get('data') or []
+            summary['status'] = action['response'].json['summary']['status']
+            summary['devices'] = [self._get_action_device_status(device) for device in devices]
+            summary['failed_devices'] = [device['host-name'] for device in summary['devices']
+                                         if device['statusId'] == 'failure']
+        return summary
+
+    def _get_wait_option(self, option, value):
+        if value is None:
+            value = self.params.get(option)
+        return self._fallback(value, ACTION_WAIT_DEFAULTS[option]['default'])
 
-    def waitfor_action_completion(self, action_id):
-        status = 'in_progress'
-        response = {}
-        while status == "in_progress":
-            response = self.request('/dataservice/device/action/status/{0}'.format(action_id))
-            if response.json:
-                status = response.json['summary']['status']
-                if 'data' in response.json and response.json['data']:
-                    action_status = response.json['data'][0]['statusId']
-                    action_activity = response.json['data'][0]['activity']
-                    if 'actionConfig' in response.json['data'][0]:
-                        action_config = response.json['data'][0]['actionConfig']
-                    else:
-                        action_config = None
-            else:
-                self.fail_json(msg="Unable to get action status: No response")
-            time.sleep(10)
+    @staticmethod
+    def _action_complete(action_json):
+        if action_json['summary']['status'] != 'in_progress':
+            return True
+        # The summary can lag behind, so stop as soon as every device has finished
+        devices = action_json.get('data') or []
+        return bool(devices) and all(device.get('statusId') in ACTION_TERMINAL_STATUSES for device in devices)
+
+    def _set_action_result(self, action_id, action_json):
+        action_status = action_activity = action_config = None
+        devices = action_json.get('data') or []
+        if devices:
+            action_status = devices[0]['statusId']
+            action_activity = devices[0]['activity']
+            action_config = devices[0].get('actionConfig')
 
-        # self.result['action_response'] = response.json
         self.result['action_id'] = action_id
         self.result['action_status'] = action_status
         self.result['action_activity'] = action_activity
         self.result['action_config'] = action_config
-        if self.result['action_status'] == 'failure':
-            self.fail_json(msg="Action failed")
-        return response
+        self.result['action_devices'] = [self._get_action_device_status(device) for device in devices]
+        self.result['action_failed_devices'] = [device['host-name'] for device in self.result['action_devices']
+                                                if device['statusId'] == 'failure']
+
+    @staticmethod
+    def _get_action_device_status(device):
+        return {
+            'host-name': device.get('host-name'),
+            'system-ip': device.get('system-ip'),
+            'uuid': device.get('uuid'),
+            'status': device.get('status'),
+            'statusId': device.get('statusId'),
+        }
 
     def exit_json(self, **kwargs):
         # self.logout()
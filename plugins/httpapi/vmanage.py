@@ -2,67 +2,133 @@ from __future__ import (absolute_import, division, print_function)
 
 __metaclass__ = type
 
-import json
+DOCUMENTATION = """
+---
+author: Cisco DevNet
+httpapi: vmanage
+short_description: HttpApi Plugin for Cisco SD-WAN vManage
+description:
+  - This HttpApi plugin provides methods to connect to the vManage REST API over a persistent
+    connection so that every task in a play shares one authenticated session.
+version_added: "2.8"
+"""
+
+import re
 
 from ansible.module_utils.basic import to_text
 from ansible.errors import AnsibleConnectionFailure
-from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.six.moves.urllib.parse import urlencode
 from ansible.plugins.httpapi import HttpApiBase
 from ansible.module_utils.connection import ConnectionError
 
 BASE_HEADERS = {
     'Content-Type': 'application/json',
 }
+LOGIN_HEADERS = {
+    'Content-Type': 'application/x-www-form-urlencoded',
+}
+SESSION_EXPIRED_STATUS_CODES = [401, 403]
+SESSION_COOKIE_REGEX = re.compile(r'JSESSIONID=(?P<session_id>[^;]+)')
 
 
 class HttpApi(HttpApiBase):
+    def __init__(self, connection):
+        super(HttpApi, self).__init__(connection)
+        self._session_id = None
+        self._logging_in = False
+
     def login(self, username, password):
-        if username and password:
-            payload = {'user': username, 'password': password}
-            url = '/web_api/login'
-            response, response_data = self.send_request(url, payload)
-        else:
+        if not username or not password:
             raise AnsibleConnectionFailure('Username and password are required for login')
 
-        try:
-            self.connection._auth = {'X-chkp-sid': response_data['sid']}
-            self.connection._session_uid = response_data['uid']
-        except KeyError:
-            raise ConnectionError(
-                'Server returned response without token info during connection authentication: %s' % response)
-
-    def logout(self):
-        url = '/logout'
-
-        response, dummy = self.send_request(url, None)
+        payload = urlencode({'j_username': username, 'j_password': password})
+        response, response_data = self.connection.send('/j_security_check', payload, method='POST',
+                                                       headers=LOGIN_HEADERS)
+        # vManage answers a failed login with the HTML login page rather than an error code
+        if self._get_response_value(response_data).startswith('<html>'):
+            raise AnsibleConnectionFailure('Could not login to vManage, check user credentials.')
 
-    def get_session_uid(self):
-        return self.connection._session_uid
-
-    def send_request(self, path, body_params):
-        data = json.dumps(body_params) if body_params else '{}'
+        self._session_id = self._get_session_id(response)
+        if not self._session_id:
+            raise ConnectionError('Server returned response without JSESSIONID during connection authentication')
+        self.connection._auth = {'Cookie': 'JSESSIONID={0}'.format(self._session_id)}
 
+        self._logging_in = True
         try:
-            self._display_request()
-            response, response_data = self.connection.send(path, data, method='POST', headers=BASE_HEADERS)
+            response, response_data = self.connection.send('/dataservice/client/token', None, method='GET',
+                                                           headers=BASE_HEADERS)
+        finally:
+            self._logging_in = False
+        if response.getcode() == 200:
+            self.connection._auth['X-XSRF-TOKEN'] = self._get_response_value(response_data)
+        elif response.getcode() == 404:
+            # Assume this is pre-19.2
+            pass
+        else:
+            raise ConnectionError('Failed getting X-XSRF-TOKEN: {0}'.format(response.getcode()))
+
+    def logout(self):
+        if self.connection._auth:
+            # /logout answers with the login page, so bypass the expired-session check in send_request
+            self.connection.send('/logout', None, method='GET', headers=BASE_HEADERS)
+        self.connection._auth = None
+        self._session_id = None
+
+    def update_auth(self, response, response_text):
+        # vManage may rotate the session cookie; keep the auth headers in step with it
+        session_id = self._get_session_id(response)
+        if session_id and self.connection._auth and session_id != self._session_id:
+            self._session_id = session_id
+            auth = dict(self.connection._auth)
+            auth['Cookie'] = 'JSESSIONID={0}'.format(session_id)
+            return auth
+        return None
+
+    def handle_httperror(self, exc):
+        if exc.code in SESSION_EXPIRED_STATUS_CODES:
+            if self.connection._auth and not self._logging_in:
+                # Stored session appears to be invalid, clear it and retry
+                self._relogin()
+                return True
+            # Unauthorized and there is no session. Return an error
+            return False
+        # Hand any other error back as a response so the module can report vManage's error details
+        return exc
+
+    def send_request(self, path, method='GET', data=None, headers=None):
+        """Send a request over the persistent connection and return the status code and body text."""
+        request_headers = dict(BASE_HEADERS)
+        if headers:
+            request_headers.update(headers)
+
+        self._display_request(method, path)
+        response, response_data = self.connection.send(path, data, method=method, headers=request_headers)
+        value = self._get_response_value(response_data)
+
+        # An expired session gets redirected to the HTML login page instead of an error code
+        if value.startswith('<html>') and self.connection._auth:
+            self._relogin()
+            response, response_data = self.connection.send(path, data, method=method, headers=request_headers)
             value = self._get_response_value(response_data)
 
-            return response.getcode(), self._response_to_json(value)
-        except AnsibleConnectionFailure as e:
-            return 404, 'Object not found'
-        except HTTPError as e:
-            error = json.loads(e.read())
-            return e.code, error
+        return response.getcode(), value
+
+    def _relogin(self):
+        self.connection._auth = None
+        self.login(self.connection.get_option('remote_user'), self.connection.get_option('password'))
 
-    def _display_request(self):
-        self.connection.queue_message('vvvv', 'Web Services: %s %s' % ('POST', self.connection._url))
+    def _display_request(self, method, path):
+        self.connection.queue_message('vvvv', 'Web Services: %s %s%s' % (method, self.connection._url, path))
 
     def _get_response_value(self, response_data):
+        if response_data is None:
+            return ''
         return to_text(response_data.getvalue())
 
-    def _response_to_json(self, response_text):
-        try:
-            return json.loads(response_text) if response_text else {}
-        # JSONDecodeError only available on Python 3.5+
-        except ValueError:
-            raise ConnectionError('Invalid JSON response: %s' % response_text)
+    def _get_session_id(self, response):
+        headers = response.info() if hasattr(response, 'info') else {}
+        cookies = headers.get('Set-Cookie') or ''
+        match = SESSION_COOKIE_REGEX.search(cookies)
+        if match:
+            return match.group('session_id')
+        return None
@@ -0,0 +1,289 @@
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = """
+---
+author: Cisco DevNet
+name: vmanage
+plugin_type: inventory
+short_description: Cisco SD-WAN vManage inventory source
+requirements:
+  - requests
+description:
+  - Builds hosts and groups from the device inventory of a vManage (C(/dataservice/system/device/vedges),
+    C(/dataservice/system/device/controllers)) joined with the device status (C(/dataservice/device)).
+  - Hosts are grouped by personality, site-id, device model, device template and reachability.
+  - "Uses a configuration file as an inventory source; it must end in C(vmanage.yml) or C(vmanage.yaml)
+    and have a C(plugin: vmanage) entry."
+  - With the inventory cache enabled, a cached inventory is reused until C(cache_timeout) passes.
+    In between, only the device status is fetched again, once it is older than C(status_refresh_interval).
+    The device inventory is fetched again only when a device shows up that is not in it.
+extends_documentation_fragment:
+  - constructed
+  - inventory_cache
+options:
+  plugin:
+    description: The name of this plugin, it should always be set to C(vmanage).
+    required: True
+    choices: ['vmanage']
+  host:
+    description: Hostname or IP address (with an optional port) of the vManage.
+    required: True
+    env:
+      - name: VMANAGE_HOST
+  user:
+    description: vManage user.
+    required: True
+    env:
+      - name: VMANAGE_USER
+  password:
+    description: vManage password.
+    required: True
+    env:
+      - name: VMANAGE_PASSWORD
+  validate_certs:
+    description: Whether to validate the certificate of the vManage.
+    type: bool
+    default: False
+  timeout:
+    description: Timeout in seconds of each request to the vManage.
+    type: int
+    default: 30
+  hostname_key:
+    description: The device attribute used as the inventory hostname.
+    type: str
+    default: host-name
+    choices: ['host-name', 'system-ip', 'uuid']
+  group_prefix:
+    description: Prefix of the names of the groups the plugin creates.
+    type: str
+    default: ''
+  status_refresh_interval:
+    description:
+      - Seconds after which the device status (e.g. reachability) in a cached inventory is fetched again.
+      - Set to 0 to refresh the status on every run.
+    type: int
+    default: 300
+"""
+
+EXAMPLES = """
+# vmanage.yml
+plugin: vmanage
+host: vmanage.example.com
+user: admin
+password: admin
+cache: yes
+cache_plugin: jsonfile
+cache_connection: ~/.ansible/vmanage_inventory
+cache_timeout: 86400
+keyed_groups:
+  - key: vmanage_version
+    prefix: version
+"""
+
+import time
+from multiprocessing.pool import ThreadPool
+
+from ansible.errors import AnsibleError, AnsibleParserError
+from ansible.module_utils._text import to_native
+from ansible.plugins.inventory import BaseInventoryPlugin, Constructable, Cacheable
+
+try:
+    import requests
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+DEVICE_TYPES = ['vedges', 'controllers']
+# Host variables and the device attributes they come from, first match wins
+HOST_VARIABLES = [
+    ('vmanage_uuid', ['uuid']),
+    ('vmanage_system_ip', ['system-ip']),
+    ('vmanage_device_ip', ['deviceIP']),
+    ('vmanage_host_name', ['host-name']),
+    ('vmanage_site_id', ['site-id']),
+    ('vmanage_personality', ['personality']),
+    ('vmanage_model', ['device-model', 'deviceModel']),
+    ('vmanage_reachability', ['reachability']),
+    ('vmanage_template', ['template']),
+    ('vmanage_template_id', ['templateId']),
+    ('vmanage_version', ['version']),
+    ('vmanage_serial_number', ['serialNumber']),
+    ('vmanage_chassis_number', ['chasisNumber']),
+]
+# Groups the hosts are put in: group name prefix and host variable
+HOST_GROUPS = [
+    ('personality', 'vmanage_personality'),
+    ('site', 'vmanage_site_id'),
+    ('model', 'vmanage_model'),
+    ('template', 'vmanage_template'),
+]
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+
+    NAME = 'vmanage'
+
+    def __init__(self):
+        super(InventoryModule, self).__init__()
+        self.session = None
+
+    def verify_file(self, path):
+        if super(InventoryModule, self).verify_file(path):
+            if path.endswith(('vmanage.yml', 'vmanage.yaml')):
+                return True
+        return False
+
+    def parse(self, inventory, loader, path, cache=True):
+        if not HAS_REQUESTS:
+            raise AnsibleParserError('The vmanage inventory plugin requires the requests Python library')
+
+        super(InventoryModule, self).parse(inventory, loader, path)
+        self._read_config_data(path)
+
+        cache_key = self.get_cache_key(path)
+        use_cache = cache and self.get_option('cache')
+
+        data = None
+        if use_cache:
+            try:
+                data = self._cache[cache_key]
+            except KeyError:
+                pass
+
+        # Rewriting the status keeps a file based cache fresh, so the age of the inventory is tracked in it
+        if data is not None and time.time() - data['inventory_timestamp'] >= self.get_option('cache_timeout'):
+            data = None
+
+        try:
+            if data is None:
+                data = self._fetch_all()
+                if self.get_option('cache'):
+                    self._cache[cache_key] = data
+            elif time.time() - data['timestamp'] >= self.get_option('status_refresh_interval'):
+                data = self._refresh_status(data)
+                self._cache[cache_key] = data
+        finally:
+            self._logout()
+
+        self._populate(data)
+
+    def _populate(self, data):
+        status = dict((device['uuid'], device) for device in data['status'] if device.get('uuid'))
+        strict = self.get_option('strict')
+        prefix = self.get_option('group_prefix')
+
+        for device_type in DEVICE_TYPES:
+            for device in data['inventory'][device_type]:
+                device = dict(device, **status.get(device.get('uuid'), {}))
+                hostname = device.get(self.get_option('hostname_key'))
+                if not hostname:
+                    # Devices that were never brought up have no host-name yet
+                    continue
+
+                host_vars = {'vmanage_device_type': device_type}
+                for name, keys in HOST_VARIABLES:
+                    for key in keys:
+                        if device.get(key) is not None:
+                            host_vars[name] = device[key]
+                            break
+
+                self.inventory.add_host(hostname)
+                for name, value in host_vars.items():
+                    self.inventory.set_variable(hostname, name, value)
+
+                for group_prefix, name in HOST_GROUPS:
+                    if host_vars.get(name):
+                        self._add_to_group(hostname, '{0}{1}_{2}'.format(prefix, group_prefix, host_vars[name]))
+                if host_vars.get('vmanage_reachability'):
+                    self._add_to_group(hostname, '{0}{1}'.format(prefix, host_vars['vmanage_reachability']))
+
+                self._set_composite_vars(self.get_option('compose'), host_vars, hostname, strict=strict)
+                self._add_host_to_composed_groups(self.get_option('groups'), host_vars, hostname, strict=strict)
+                self._add_host_to_keyed_groups(self.get_option('keyed_groups'), host_vars, hostname, strict=strict)
+
+    def _add_to_group(self, hostname, group):
+        group = self.inventory.add_group(self._sanitize_group_name(group))
+        self.inventory.add_child(group, hostname)
+
+    def _fetch_all(self):
+        # The two inventories and the status are independent, so they are fetched together
+        paths = ['/dataservice/system/device/{0}'.format(device_type) for device_type in DEVICE_TYPES]
+        paths.append('/dataservice/device')
+        results = self._get_many(paths)
+        return {
+            'timestamp': time.time(),
+            'inventory_timestamp': time.time(),
+            'inventory': dict(zip(DEVICE_TYPES, results[:-1])),
+            'status': results[-1],
+        }
+
+    def _refresh_status(self, data):
+        status = self._get_many(['/dataservice/device'])[0]
+        known = set(device.get('uuid') for device_type in DEVICE_TYPES for device in data['inventory'][device_type])
+        if any(device.get('uuid') not in known for device in status):
+            # A device was added since the inventory was cached
+            return self._fetch_all()
+        return dict(data, timestamp=time.time(), status=status)
+
+    def _get_many(self, paths):
+        if self.session is None:
+            self._login()
+
+        pool = ThreadPool(len(paths))
+        try:
+            return pool.map(self._get, paths)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _get(self, path):
+        try:
+            response = self.session.get('https://{0}{1}'.format(self.get_option('host'), path),
+                                        timeout=self.get_option('timeout'))
+        except requests.exceptions.RequestException as e:
+            raise AnsibleError('Could not get {0} from vManage: {1}'.format(path, to_native(e)))
+        if response.status_code != 200:
+            raise AnsibleError('Could not get {0} from vManage: {1}'.format(path, response.status_code))
+        try:
+            return response.json().get('data', [])
+        except ValueError:
+            raise AnsibleError('vManage returned an invalid response for {0}'.format(path))
+
+    def _logout(self):
+        # vManage limits the sessions of a user, so the session of every run is closed instead of left to expire
+        if self.session is None:
+            return
+        try:
+            self.session.get('https://{0}/logout'.format(self.get_option('host')),
+                             timeout=self.get_option('timeout'), allow_redirects=False)
+        except requests.exceptions.RequestException:
+            pass
+        finally:
+            self.session.close()
+            self.session = None
+
+    def _login(self):
+        self.session = requests.Session()
+        self.session.verify = self.get_option('validate_certs')
+        host = self.get_option('host')
+
+        try:
+            response = self.session.post('https://{0}/j_security_check'.format(host),
+                                         headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                         data={'j_username': self.get_option('user'),
+                                               'j_password': self.get_option('password')},
+                                         timeout=self.get_option('timeout'))
+            if response.text.startswith('<html>'):
+                raise AnsibleError('Could not login to vManage, check user credentials.')
+
+            response = self.session.get('https://{0}/dataservice/client/token'.format(host),
+                                        timeout=self.get_option('timeout'))
+        except requests.exceptions.RequestException as e:
+            raise AnsibleError('Could not login to vManage: {0}'.format(to_native(e)))
+        if response.status_code == 200:
+            self.session.headers['X-XSRF-TOKEN'] = response.content
+        elif response.status_code != 404:
+            # 404 means pre-19.2, which has no token
+            raise AnsibleError('Failed getting X-XSRF-TOKEN: {0}'.format(response.status_code))